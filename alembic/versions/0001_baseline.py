@@ -0,0 +1,64 @@
+"""baseline schema
+
+Схема, которую раньше создавал Base.metadata.create_all при импорте приложения.
+Для существующей базы выполните `alembic stamp 0001`, затем `alembic upgrade head`.
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-17 12:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'products',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('description', sa.String(), nullable=True),
+        sa.Column('price', sa.Float(), nullable=True),
+        sa.Column('quantity', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_products_id', 'products', ['id'])
+    op.create_index('ix_products_name', 'products', ['name'])
+
+    op.create_table(
+        'orders',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+    op.create_table(
+        'order_items',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=True),
+        sa.Column('order_id', sa.Integer(), nullable=True),
+        sa.Column('quantity', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['order_id'], ['orders.id']),
+        sa.ForeignKeyConstraint(['product_id'], ['products.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_order_items_id', 'order_items', ['id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_order_items_id', table_name='order_items')
+    op.drop_table('order_items')
+    op.drop_table('orders')
+    op.drop_index('ix_products_name', table_name='products')
+    op.drop_index('ix_products_id', table_name='products')
+    op.drop_table('products')
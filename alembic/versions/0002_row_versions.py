@@ -0,0 +1,28 @@
+"""row version columns for ETag and If-Match
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 12:00:01
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('products', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('orders', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('orders', 'version')
+    op.drop_column('products', 'version')
@@ -0,0 +1,38 @@
+"""indexes for the order and product query patterns
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 12:00:02
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_order_items_order_id_product_id', 'order_items', ['order_id', 'product_id'])
+    op.create_index('ix_order_items_product_id', 'order_items', ['product_id'])
+    op.create_index('ix_orders_status_created_at', 'orders', ['status', 'created_at'])
+    # Индекс с varchar_pattern_ops обслуживает и равенство, и LIKE по префиксу,
+    # поэтому заменяет прежний индекс по name
+    op.create_index(
+        'ix_products_name_pattern', 'products', ['name'],
+        postgresql_ops={'name': 'varchar_pattern_ops'},
+    )
+    op.drop_index('ix_products_name', table_name='products')
+
+
+def downgrade() -> None:
+    op.create_index('ix_products_name', 'products', ['name'])
+    op.drop_index('ix_products_name_pattern', table_name='products')
+    op.drop_index('ix_orders_status_created_at', table_name='orders')
+    op.drop_index('ix_order_items_product_id', table_name='order_items')
+    op.drop_index('ix_order_items_order_id_product_id', table_name='order_items')
@@ -0,0 +1,55 @@
+"""sharded stock counters and stock movement ledger
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 12:00:03
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Шарды создаются лениво при первом заказе товара, до этого остатком
+    # служит products.quantity, поэтому заполнять таблицу не нужно
+    op.create_table(
+        'stock_shards',
+        sa.Column('product_id', sa.Integer(), sa.ForeignKey('products.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('shard', sa.Integer(), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('product_id', 'shard'),
+    )
+    op.create_table(
+        'stock_movements',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), sa.ForeignKey('products.id'), nullable=False),
+        sa.Column('order_id', sa.Integer(), sa.ForeignKey('orders.id'), nullable=True),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_stock_movements_order_id', 'stock_movements', ['order_id'])
+    op.create_index('ix_stock_movements_product_id', 'stock_movements', ['product_id'])
+
+
+def downgrade() -> None:
+    # Остаток из шардов переносится обратно в products.quantity
+    op.execute(
+        "UPDATE products SET quantity = s.total "
+        "FROM (SELECT product_id, sum(quantity) AS total FROM stock_shards GROUP BY product_id) AS s "
+        "WHERE products.id = s.product_id"
+    )
+    op.drop_index('ix_stock_movements_product_id', table_name='stock_movements')
+    op.drop_index('ix_stock_movements_order_id', table_name='stock_movements')
+    op.drop_table('stock_movements')
+    op.drop_table('stock_shards')
@@ -0,0 +1,32 @@
+"""full-text search vector for products
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 12:00:04
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Вычисляемая колонка хранится и обновляется самой базой при изменении name и description
+    op.execute(
+        "ALTER TABLE products ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('russian', coalesce(description, '')), 'B')) STORED"
+    )
+    op.create_index('ix_products_search_vector', 'products', ['search_vector'], postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_products_search_vector', table_name='products')
+    op.drop_column('products', 'search_vector')
@@ -0,0 +1,62 @@
+"""report summary tables for sales and order statuses
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 12:00:05
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Должно совпадать с REPORT_SHARDS приложения на момент миграции; при другом
+# значении сводки остаются верными, меняется только разбиение строк по шардам
+REPORT_SHARDS = 8
+
+
+def upgrade() -> None:
+    op.create_table(
+        'sales_daily',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('product_id', sa.Integer(), sa.ForeignKey('products.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('shard', sa.Integer(), nullable=False),
+        sa.Column('units', sa.Integer(), nullable=False),
+        sa.Column('orders', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'product_id', 'shard'),
+    )
+    op.create_index('ix_sales_daily_product_id_day', 'sales_daily', ['product_id', 'day'])
+    op.create_table(
+        'order_status_counts',
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('shard', sa.Integer(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('status', 'shard'),
+    )
+
+    # Начальное заполнение сводок по существующим заказам
+    op.execute(
+        "INSERT INTO sales_daily (day, product_id, shard, units, orders) "
+        f"SELECT date(o.created_at), i.product_id, o.id % {REPORT_SHARDS}, sum(i.quantity), count(DISTINCT o.id) "
+        "FROM order_items i JOIN orders o ON o.id = i.order_id "
+        "WHERE o.status IS NOT NULL AND o.created_at IS NOT NULL AND o.status <> 'отменён' "
+        "GROUP BY 1, 2, 3"
+    )
+    op.execute(
+        "INSERT INTO order_status_counts (status, shard, count) "
+        f"SELECT status, id % {REPORT_SHARDS}, count(*) FROM orders "
+        "WHERE status IS NOT NULL AND created_at IS NOT NULL GROUP BY 1, 2"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('order_status_counts')
+    op.drop_index('ix_sales_daily_product_id_day', table_name='sales_daily')
+    op.drop_table('sales_daily')
@@ -0,0 +1,36 @@
+"""idempotency keys with stored responses
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 12:00:06
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('fingerprint', sa.String(), nullable=False),
+        sa.Column('status_code', sa.Integer(), nullable=True),
+        sa.Column('response', sa.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('key'),
+    )
+    op.create_index('ix_idempotency_keys_created_at', 'idempotency_keys', ['created_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_idempotency_keys_created_at', table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
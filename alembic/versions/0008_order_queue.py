@@ -0,0 +1,35 @@
+"""queue of orders accepted for asynchronous processing
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 12:00:07
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('orders', sa.Column('status_detail', sa.String(), nullable=True))
+    op.create_table(
+        'order_jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('order_id', sa.Integer(), sa.ForeignKey('orders.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('order_id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('order_jobs')
+    op.drop_column('orders', 'status_detail')
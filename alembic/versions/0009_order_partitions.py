@@ -0,0 +1,181 @@
+"""monthly partitions of orders and order_items, archive of delivered orders
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17 12:00:08
+
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0009'
+down_revision: Union[str, None] = '0008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Секции создаются с месяца самого старого заказа до текущего месяца и ещё на
+# столько месяцев вперёд (как ORDER_PARTITIONS_AHEAD приложения); дальше их
+# создаёт фоновая задача archive.maintain_orders
+MONTHS_AHEAD = 3
+
+ORDER_COLUMNS = "id, created_at, status, status_detail, version"
+ORDER_ITEM_COLUMNS = "id, product_id, order_id, quantity"
+
+
+def next_month(month: date) -> date:
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def create_partitions(table: str, first: date, last: date) -> None:
+    month = first
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE {table}_{month:%Y_%m} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+        )
+        month = next_month(month)
+    op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+
+# Ограничения и индексы рабочих таблиц заказов; первичные ключи передаются
+# отдельно, потому что в секционированных таблицах они включают created_at
+def create_order_constraints(key: list) -> None:
+    op.create_primary_key('orders_pkey', 'orders', key)
+    op.create_primary_key('order_items_pkey', 'order_items', key)
+    op.create_foreign_key('order_items_order_id_fkey', 'order_items', 'orders', ['order_id', *key[1:]], key)
+    op.create_foreign_key('order_items_product_id_fkey', 'order_items', 'products', ['product_id'], ['id'])
+    op.create_index('ix_orders_status_created_at', 'orders', ['status', 'created_at'])
+    op.create_index('ix_order_items_order_id_product_id', 'order_items', ['order_id', 'product_id'])
+    op.create_index('ix_order_items_product_id', 'order_items', ['product_id'])
+
+
+def upgrade() -> None:
+    # На секционированную таблицу можно сослаться только по (id, created_at)
+    op.drop_constraint('stock_movements_order_id_fkey', 'stock_movements', type_='foreignkey')
+    op.drop_constraint('order_jobs_order_id_fkey', 'order_jobs', type_='foreignkey')
+
+    # Новые таблицы создаются рядом со старыми и заполняются из них; последовательности
+    # id отвязываются от старых таблиц, чтобы не удалиться вместе с ними
+    op.rename_table('order_items', 'order_items_unpartitioned')
+    op.rename_table('orders', 'orders_unpartitioned')
+    op.execute("ALTER SEQUENCE orders_id_seq OWNED BY NONE")
+    op.execute("ALTER SEQUENCE order_items_id_seq OWNED BY NONE")
+    op.execute(
+        "CREATE TABLE orders ("
+        "id integer NOT NULL DEFAULT nextval('orders_id_seq'), "
+        "created_at timestamp without time zone NOT NULL, "
+        "status varchar, "
+        "status_detail varchar, "
+        "version integer NOT NULL DEFAULT 1"
+        ") PARTITION BY RANGE (created_at)"
+    )
+    op.execute(
+        "CREATE TABLE order_items ("
+        "id integer NOT NULL DEFAULT nextval('order_items_id_seq'), "
+        "product_id integer, "
+        "order_id integer, "
+        "quantity integer, "
+        "created_at timestamp without time zone NOT NULL"
+        ") PARTITION BY RANGE (created_at)"
+    )
+
+    today = datetime.now(timezone.utc).date()
+    oldest = op.get_bind().scalar(sa.text("SELECT min(created_at) FROM orders_unpartitioned"))
+    first = (oldest.date() if oldest is not None else today).replace(day=1)
+    last = today.replace(day=1)
+    for _ in range(MONTHS_AHEAD):
+        last = next_month(last)
+    create_partitions('orders', first, last)
+    create_partitions('order_items', first, last)
+
+    # Заказы без времени создания (до его появления в модели) получают текущее время
+    op.execute(
+        f"INSERT INTO orders ({ORDER_COLUMNS}) "
+        "SELECT id, coalesce(created_at, timezone('utc', now())), status, status_detail, version "
+        "FROM orders_unpartitioned"
+    )
+    op.execute(
+        f"INSERT INTO order_items ({ORDER_ITEM_COLUMNS}, created_at) "
+        "SELECT i.id, i.product_id, i.order_id, i.quantity, coalesce(o.created_at, timezone('utc', now())) "
+        "FROM order_items_unpartitioned i LEFT JOIN orders o ON o.id = i.order_id"
+    )
+    op.drop_table('order_items_unpartitioned')
+    op.drop_table('orders_unpartitioned')
+    op.execute("ALTER SEQUENCE orders_id_seq OWNED BY orders.id")
+    op.execute("ALTER SEQUENCE order_items_id_seq OWNED BY order_items.id")
+    create_order_constraints(['id', 'created_at'])
+
+    op.create_table(
+        'orders_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('status_detail', sa.String(), nullable=True),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_orders_archive_created_at', 'orders_archive', ['created_at'])
+    op.create_table(
+        'order_items_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('product_id', sa.Integer(), sa.ForeignKey('products.id'), nullable=True),
+        sa.Column('order_id', sa.Integer(), sa.ForeignKey('orders_archive.id'), nullable=True),
+        sa.Column('quantity', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_order_items_archive_order_id', 'order_items_archive', ['order_id'])
+    op.create_index('ix_order_items_archive_product_id', 'order_items_archive', ['product_id'])
+
+
+def downgrade() -> None:
+    # Обычные таблицы заполняются из секций и архива, архивные заказы возвращаются
+    op.rename_table('order_items', 'order_items_partitioned')
+    op.rename_table('orders', 'orders_partitioned')
+    op.execute("ALTER SEQUENCE orders_id_seq OWNED BY NONE")
+    op.execute("ALTER SEQUENCE order_items_id_seq OWNED BY NONE")
+    op.create_table(
+        'orders',
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('orders_id_seq')"), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('version', sa.Integer(), server_default='1', nullable=False),
+        sa.Column('status_detail', sa.String(), nullable=True),
+    )
+    op.create_table(
+        'order_items',
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('order_items_id_seq')"), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=True),
+        sa.Column('order_id', sa.Integer(), nullable=True),
+        sa.Column('quantity', sa.Integer(), nullable=True),
+    )
+    op.execute(
+        f"INSERT INTO orders ({ORDER_COLUMNS}) "
+        f"SELECT {ORDER_COLUMNS} FROM orders_partitioned "
+        f"UNION ALL SELECT {ORDER_COLUMNS} FROM orders_archive"
+    )
+    op.execute(
+        f"INSERT INTO order_items ({ORDER_ITEM_COLUMNS}) "
+        f"SELECT {ORDER_ITEM_COLUMNS} FROM order_items_partitioned "
+        f"UNION ALL SELECT {ORDER_ITEM_COLUMNS} FROM order_items_archive"
+    )
+    op.drop_index('ix_order_items_archive_product_id', table_name='order_items_archive')
+    op.drop_index('ix_order_items_archive_order_id', table_name='order_items_archive')
+    op.drop_table('order_items_archive')
+    op.drop_index('ix_orders_archive_created_at', table_name='orders_archive')
+    op.drop_table('orders_archive')
+    op.drop_table('order_items_partitioned')
+    op.drop_table('orders_partitioned')
+    op.execute("ALTER SEQUENCE orders_id_seq OWNED BY orders.id")
+    op.execute("ALTER SEQUENCE order_items_id_seq OWNED BY order_items.id")
+    create_order_constraints(['id'])
+    op.create_index('ix_order_items_id', 'order_items', ['id'])
+
+    op.create_foreign_key('order_jobs_order_id_fkey', 'order_jobs', 'orders', ['order_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('stock_movements_order_id_fkey', 'stock_movements', 'orders', ['order_id'], ['id'])
@@ -0,0 +1,54 @@
+"""product snapshot on order items, order totals and item counts
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-17 12:00:09
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0010'
+down_revision: Union[str, None] = '0009'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Рабочие и архивные таблицы заказов и их позиций
+ORDER_TABLES = (('orders', 'order_items'), ('orders_archive', 'order_items_archive'))
+
+
+def upgrade() -> None:
+    for orders, order_items in ORDER_TABLES:
+        op.add_column(orders, sa.Column('total', sa.Float(), server_default='0', nullable=False))
+        op.add_column(orders, sa.Column('item_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(order_items, sa.Column('product_name', sa.String(), nullable=True))
+        op.add_column(order_items, sa.Column('product_description', sa.String(), nullable=True))
+        op.add_column(order_items, sa.Column('unit_price', sa.Float(), nullable=True))
+
+        # Цен на момент покупки для существующих заказов нет: снимок берётся из
+        # текущих данных товаров
+        op.execute(
+            f"UPDATE {order_items} i SET product_name = p.name, product_description = p.description, "
+            "unit_price = p.price FROM products p WHERE p.id = i.product_id"
+        )
+        op.execute(
+            f"UPDATE {orders} o SET total = t.total, item_count = t.item_count FROM ("
+            "SELECT order_id, coalesce(sum(unit_price * quantity), 0) AS total, sum(quantity) AS item_count "
+            f"FROM {order_items} GROUP BY order_id"
+            ") t WHERE t.order_id = o.id"
+        )
+    op.create_index('ix_orders_total_id', 'orders', ['total', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_orders_total_id', table_name='orders')
+    for orders, order_items in ORDER_TABLES:
+        op.drop_column(order_items, 'unit_price')
+        op.drop_column(order_items, 'product_description')
+        op.drop_column(order_items, 'product_name')
+        op.drop_column(orders, 'item_count')
+        op.drop_column(orders, 'total')
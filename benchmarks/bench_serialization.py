@@ -0,0 +1,94 @@
+"""Сравнение обычного и быстрого пути сериализации списка заказов.
+
+Обычный путь повторяет GET /orders/: ORM-объекты проверяются схемой
+OrderPage и кодируются jsonable_encoder + json. Быстрый путь (?fast=true)
+собирает словари из кортежей колонок и кодирует их orjson.
+Замеряется только CPU на сериализацию, база данных не нужна.
+
+Запуск: python -m benchmarks.bench_serialization [--sizes 1000 10000 100000]
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+from src import models, schemas
+
+
+# У каждого заказа две позиции по одной штуке со снимком товара (как в GET /orders/)
+def build_orm_orders(count: int):
+    orders = []
+    for order_id in range(1, count + 1):
+        order = models.Order(id=order_id, created_at=datetime(2024, 1, 1), status="в процессе", status_detail=None,
+                             version=1, total=3.0, item_count=2)
+        order.items = [models.OrderItem(id=order_id * 2 + offset, order_id=order_id, product_id=offset + 1, quantity=1,
+                                        product_name=f"Product {offset + 1}", unit_price=offset + 1.0)
+                       for offset in range(2)]
+        orders.append(order)
+    return orders
+
+
+def build_rows(count: int):
+    orders = [(order_id, datetime(2024, 1, 1), "в процессе", None, 1, 3.0, 2) for order_id in range(1, count + 1)]
+    items = [(order_id, order_id * 2 + offset, offset + 1, 1, f"Product {offset + 1}", offset + 1.0)
+             for order_id in range(1, count + 1) for offset in range(2)]
+    return orders, items
+
+
+def default_path(orders) -> bytes:
+    page = schemas.OrderPage.parse_obj({"items": orders, "next_cursor": None})
+    return json.dumps(jsonable_encoder(page), ensure_ascii=False).encode()
+
+
+def fast_path(order_rows, item_rows) -> bytes:
+    items = {row[0]: [] for row in order_rows}
+    for order_id, item_id, product_id, quantity, product_name, unit_price in item_rows:
+        items[order_id].append({
+            "id": item_id, "product_id": product_id, "quantity": quantity,
+            "product_name": product_name, "unit_price": unit_price,
+        })
+    page = {
+        "items": [
+            {"id": order_id, "created_at": created_at, "status": status, "status_detail": status_detail,
+             "version": version, "total": total, "item_count": item_count, "items": items[order_id]}
+            for order_id, created_at, status, status_detail, version, total, item_count in order_rows
+        ],
+        "next_cursor": None,
+    }
+    return orjson.dumps(page)
+
+
+def measure(func, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        orm_orders = build_orm_orders(size)
+        order_rows, item_rows = build_rows(size)
+        default_seconds = measure(default_path, orm_orders)
+        fast_seconds = measure(fast_path, order_rows, item_rows)
+        results.append({
+            "rows": size,
+            "default_ms": round(default_seconds * 1000, 1),
+            "fast_ms": round(fast_seconds * 1000, 1),
+            "speedup": round(default_seconds / fast_seconds, 1),
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
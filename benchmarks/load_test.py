@@ -0,0 +1,255 @@
+"""Нагрузочный тест API склада со смешанной нагрузкой чтения и записи.
+
+Заполняет базу набором товаров, заказов и позиций заданного размера и
+прогоняет через настоящие эндпоинты (/products/, /products/{id}, /orders/,
+/orders/{id}, POST /orders/, PATCH /orders/{id}/status) смешанную нагрузку
+с фиксированной конкурентностью. Результат — JSON с RPS, p50/p95/p99 и
+средним числом SQL-запросов на запрос для каждого эндпоинта.
+
+По умолчанию приложение запускается в том же процессе (через ASGI, без сети)
+на SQLite-файле; для PostgreSQL передайте --database-url. Данные пишутся
+в указанную базу, поэтому не направляйте тест на рабочую базу.
+
+Запуск: python -m benchmarks.load_test --products 1000 --orders 5000 --requests 2000 --concurrency 32
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+DEFAULT_DATABASE_URL = "sqlite+aiosqlite:///./bench_warehouse.db"
+
+# Веса эндпоинтов в смешанной нагрузке
+DEFAULT_MIX = {
+    "GET /products/": 20,
+    "GET /products/{id}": 30,
+    "GET /orders/": 10,
+    "GET /orders/{id}": 20,
+    "POST /orders/": 15,
+    "PATCH /orders/{id}/status": 5,
+}
+
+STATUSES = ["в процессе", "отправлен", "доставлен"]
+
+# Эндпоинт, к которому относятся SQL-запросы, выполняемые в текущей задаче
+current_endpoint = contextvars.ContextVar("current_endpoint", default=None)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL", DEFAULT_DATABASE_URL))
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--items-per-order", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=2000, help="всего запросов в измерении")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mix", type=json.loads, default=DEFAULT_MIX,
+                        help='веса эндпоинтов в JSON, например \'{"GET /products/": 1}\'')
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="путь для JSON-отчёта (по умолчанию stdout)")
+    return parser.parse_args(argv)
+
+
+# Заполнение базы; возвращает статусы заказов по id (для переходов PATCH)
+async def seed_database(engine, models, products: int, orders: int, items_per_order: int, rng: random.Random) -> dict:
+    from sqlalchemy import delete, insert
+
+    async with engine.begin() as connection:
+        await connection.run_sync(models.Base.metadata.create_all)
+        for table in (models.SalesDaily, models.OrderStatusCount, models.StockMovement, models.StockShard, models.OrderItem, models.Order, models.Product):
+            await connection.execute(delete(table))
+
+        prices = {product_id: round(rng.uniform(1, 500), 2) for product_id in range(1, products + 1)}
+        await connection.execute(insert(models.Product), [
+            {"id": product_id, "name": f"Product {product_id}", "description": "benchmark",
+             "price": price, "quantity": 1_000_000, "version": 1}
+            for product_id, price in prices.items()
+        ])
+        # Позиции со снимком товара, как при создании заказа через API
+        items = [
+            {"order_id": order_id, "product_id": product_id, "quantity": rng.randint(1, 5),
+             "product_name": f"Product {product_id}", "product_description": "benchmark", "unit_price": prices[product_id]}
+            for order_id in range(1, orders + 1)
+            for product_id in (rng.randint(1, products) for _ in range(items_per_order))
+        ]
+        totals = defaultdict(lambda: [0.0, 0])
+        for item in items:
+            totals[item["order_id"]][0] += item["unit_price"] * item["quantity"]
+            totals[item["order_id"]][1] += item["quantity"]
+        statuses = {order_id: rng.choice(STATUSES) for order_id in range(1, orders + 1)}
+        await connection.execute(insert(models.Order), [
+            {"id": order_id, "created_at": datetime_for(order_id, orders), "status": status, "version": 1,
+             "total": round(totals[order_id][0], 2), "item_count": totals[order_id][1]}
+            for order_id, status in statuses.items()
+        ])
+        await connection.execute(insert(models.OrderItem), items)
+
+    # Последовательности PostgreSQL не знают о явно вставленных id
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy import text
+
+        async with engine.begin() as connection:
+            for table in ("products", "orders"):
+                await connection.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"
+                ))
+    return statuses
+
+
+# Заказы создаются с интервалом в секунду и заканчиваются текущим моментом,
+# чтобы попасть в окно GET /orders/ по умолчанию (ORDERS_RECENT_DAYS)
+def datetime_for(order_id: int, orders: int):
+    from datetime import datetime, timedelta, timezone
+
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=orders - order_id)
+
+
+def build_request(endpoint: str, rng: random.Random, products: int, orders: int, statuses: dict):
+    if endpoint == "GET /products/":
+        return "GET", "/products/", {"params": {"limit": 50}}
+    if endpoint == "GET /products/{id}":
+        return "GET", f"/products/{rng.randint(1, products)}", {}
+    if endpoint == "GET /orders/":
+        return "GET", "/orders/", {"params": {"limit": 50, "status": rng.choice(STATUSES)}}
+    if endpoint == "GET /orders/{id}":
+        return "GET", f"/orders/{rng.randint(1, orders)}", {}
+    if endpoint == "POST /orders/":
+        items = [{"product_id": rng.randint(1, products), "quantity": 1} for _ in range(rng.randint(1, 3))]
+        return "POST", "/orders/", {"json": {"items": items}}
+    if endpoint == "PATCH /orders/{id}/status":
+        # Допустимый переход по графу статусов для заказа, который ещё можно перевести
+        from src.order_status import ORDER_STATUS_TRANSITIONS
+
+        for _ in range(100):
+            order_id = rng.randint(1, orders)
+            targets = ORDER_STATUS_TRANSITIONS[statuses[order_id]]
+            if targets:
+                break
+        else:
+            targets = STATUSES
+        status = statuses[order_id] = rng.choice(targets)
+        return "PATCH", f"/orders/{order_id}/status", {"data": {"status": status}}
+    raise ValueError(f"Unknown endpoint: {endpoint}")
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, queries, elapsed: float) -> dict:
+    report = {}
+    for endpoint, values in sorted(latencies.items()):
+        values.sort()
+        report[endpoint] = {
+            "requests": len(values),
+            "errors": errors[endpoint],
+            "rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+            "mean_ms": round(statistics.fmean(values) * 1000, 2),
+            "queries_per_request": round(queries[endpoint] / len(values), 2),
+        }
+    return report
+
+
+async def run(args) -> dict:
+    import httpx
+    from sqlalchemy import event
+
+    from src import admission, events, models
+    from src.database import configure_database, get_engine
+    from src.main import create_app
+
+    configure_database(args.database_url)
+    engine = get_engine()
+    # Бэкенд событий по умолчанию выбран по DATABASE_URL, а LISTEN/NOTIFY есть только в PostgreSQL
+    if engine.dialect.name != "postgresql":
+        events.broker = events.build_broker("memory")
+    # Тест измеряет эндпоинты, а не ограничение частоты: все запросы идут от одного клиента
+    admission.rate_limiter.backend = None
+    app = create_app(background_tasks=False)
+
+    rng = random.Random(args.seed)
+    statuses = await seed_database(engine, models, args.products, args.orders, args.items_per_order, rng)
+
+    queries = defaultdict(int)
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        endpoint = current_endpoint.get()
+        if endpoint is not None:
+            queries[endpoint] += 1
+
+    endpoints = list(args.mix)
+    weights = [args.mix[endpoint] for endpoint in endpoints]
+    plan = [rng.choices(endpoints, weights)[0] for _ in range(args.requests)]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        queue = iter(plan)
+
+        async def worker():
+            for endpoint in queue:
+                method, url, kwargs = build_request(endpoint, rng, args.products, args.orders, statuses)
+                current_endpoint.set(endpoint)
+                started = time.perf_counter()
+                response = await client.request(method, url, **kwargs)
+                latencies[endpoint].append(time.perf_counter() - started)
+                current_endpoint.set(None)
+                # 400 — штатный ответ при нехватке товара, остальные ошибки считаются
+                if response.status_code >= 500 or response.status_code in (404, 422, 429):
+                    errors[endpoint] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    await engine.dispose()
+
+    all_latencies = sorted(value for values in latencies.values() for value in values)
+    return {
+        "config": {
+            "database": engine.dialect.name,
+            "products": args.products,
+            "orders": args.orders,
+            "items_per_order": args.items_per_order,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "mix": args.mix,
+        },
+        "total": {
+            "requests": len(all_latencies),
+            "errors": sum(errors.values()),
+            "elapsed_s": round(elapsed, 2),
+            "rps": round(len(all_latencies) / elapsed, 1),
+            "p50_ms": round(percentile(all_latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(all_latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(all_latencies, 0.99) * 1000, 2),
+            "queries_per_request": round(sum(queries.values()) / len(all_latencies), 2),
+        },
+        "endpoints": summarize(latencies, errors, queries, elapsed),
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = json.dumps(asyncio.run(run(args)), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(report + "\n")
+    else:
+        sys.stdout.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Профиль запуска в несколько процессов: gunicorn управляет процессами,
+# каждый процесс — асинхронный воркер uvicorn со своими пулами соединений.
+#   gunicorn -c gunicorn.conf.py src.main:app
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Метрики Prometheus собираются со всех процессов: каждый пишет их в файлы
+# каталога PROMETHEUS_MULTIPROC_DIR, /metrics любого процесса отдаёт сумму.
+# Переменная задаётся до импорта prometheus_client в процессах.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="warehouse-metrics-"))
+
+# Кэш товаров и ограничение частоты в памяти у каждого процесса свои: процесс
+# сбрасывает только свой кэш, и остальные отдают старый остаток до CACHE_TTL,
+# а предел частоты умножается на число процессов. Поэтому при нескольких
+# процессах нужен общий бэкенд redis (или none).
+from src.admission import RATE_LIMIT_BACKEND  # noqa: E402
+from src.cache import CACHE_BACKEND  # noqa: E402
+
+if workers > 1:
+    for setting, backend in (("CACHE_BACKEND", CACHE_BACKEND), ("RATE_LIMIT_BACKEND", RATE_LIMIT_BACKEND)):
+        if backend == "memory":
+            raise RuntimeError(f"{setting}=memory is per process; use redis or none with {workers} workers")
+
+# Приложение импортируется в каждом процессе после fork: движок базы данных
+# и соединение LISTEN событий не должны делиться между процессами
+preload_app = False
+
+# Воркер, не ответивший за timeout секунд, перезапускается; при остановке
+# запросы (и потоки событий) завершаются за graceful_timeout секунд
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Периодический перезапуск воркеров ограничивает рост памяти; разброс
+# не даёт всем воркерам перезапуститься одновременно
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "1000"))
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-")
+
+
+# Файлы метрик прошлого запуска удаляются, файлы завершившегося процесса
+# помечаются, чтобы его метрики не учитывались дважды
+def on_starting(server):
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,231 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from fastapi import HTTPException, Request
+
+from . import metrics
+from .cache import REDIS_URL
+from .database import DB_POOL_SIZE
+
+# Ограничение частоты запросов на запись: бэкенд (none, memory или redis), скорость
+# пополнения (запросов в секунду) и ёмкость корзины токенов для одного клиента и для
+# всех клиентов вместе (скорость 0 — без ограничения). По умолчанию выключено:
+# включать вместе с RATE_LIMIT_CLIENT_HEADER, иначе за прокси все клиенты
+# попадают в одну корзину адреса прокси. При нескольких процессах (gunicorn)
+# корзины memory у каждого свои, общий предел даёт только redis.
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "none")
+RATE_LIMIT_CLIENT_RATE = float(os.getenv("RATE_LIMIT_CLIENT_RATE", "10"))
+RATE_LIMIT_CLIENT_BURST = float(os.getenv("RATE_LIMIT_CLIENT_BURST", "20"))
+RATE_LIMIT_GLOBAL_RATE = float(os.getenv("RATE_LIMIT_GLOBAL_RATE", "500"))
+RATE_LIMIT_GLOBAL_BURST = float(os.getenv("RATE_LIMIT_GLOBAL_BURST", "1000"))
+# Заголовок с идентификатором клиента (например, X-API-Key или X-Forwarded-For за
+# прокси); без него клиент определяется по адресу соединения
+RATE_LIMIT_CLIENT_HEADER = os.getenv("RATE_LIMIT_CLIENT_HEADER")
+# Сколько корзин клиентов хранит бэкенд memory (вытесняются давно не писавшие)
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "100000"))
+
+# Ограничение одновременных записей заказов: число запросов, выполняющихся сразу
+# (по умолчанию размер пула, переполнение пула остаётся чтению), длина очереди
+# ожидающих и наибольшее ожидание в секундах; остальные сразу получают 503
+ORDER_WRITE_CONCURRENCY = int(os.getenv("ORDER_WRITE_CONCURRENCY", str(DB_POOL_SIZE)))
+ORDER_WRITE_QUEUE_SIZE = int(os.getenv("ORDER_WRITE_QUEUE_SIZE", str(4 * ORDER_WRITE_CONCURRENCY)))
+ORDER_WRITE_QUEUE_TIMEOUT = float(os.getenv("ORDER_WRITE_QUEUE_TIMEOUT", "1"))
+ORDER_WRITE_RETRY_AFTER = int(os.getenv("ORDER_WRITE_RETRY_AFTER", "1"))
+
+
+# Корзины токенов в памяти процесса. Корзина хранит остаток токенов и время
+# последнего пополнения; вытесненная корзина при следующем запросе снова полна.
+class MemoryRateLimiter:
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_CLIENTS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Списание cost токенов; возвращает 0, если запрос разрешён, иначе сколько
+    # секунд ждать, пока в корзине накопится нужное количество
+    async def acquire(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+# Корзины токенов в Redis (redis.asyncio или совместимый клиент, например fakeredis):
+# общие для всех процессов приложения. Пополнение и списание выполняются одним
+# скриптом Lua по часам Redis, поэтому атомарны и не зависят от часов процессов.
+class RedisRateLimiter:
+    script = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(wait)
+"""
+
+    def __init__(self, client, prefix: str = "warehouse:ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def acquire(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        # Дробные числа возвращаются из Lua строкой: числа Lua Redis округляет до целых
+        return float(await self.client.eval(self.script, 1, self.prefix + key, rate, burst, cost))
+
+
+# Ограничение частоты: сначала корзина клиента, затем общая, чтобы один
+# клиент, превысивший свой предел, не расходовал общие токены
+class RateLimiter:
+    def __init__(
+        self,
+        backend,
+        client_rate: float = RATE_LIMIT_CLIENT_RATE,
+        client_burst: float = RATE_LIMIT_CLIENT_BURST,
+        global_rate: float = RATE_LIMIT_GLOBAL_RATE,
+        global_burst: float = RATE_LIMIT_GLOBAL_BURST,
+    ):
+        self.backend = backend
+        self.limits = [
+            (prefix, rate, burst)
+            for prefix, rate, burst in (("client:", client_rate, client_burst), ("global", global_rate, global_burst))
+            if rate > 0
+        ]
+
+    # Возвращает 0, если запрос разрешён, иначе рекомендуемую паузу в секундах
+    async def check(self, client: str) -> float:
+        if self.backend is None:
+            return 0.0
+        for prefix, rate, burst in self.limits:
+            key = prefix + client if prefix == "client:" else prefix
+            wait = await self.backend.acquire(key, rate, burst)
+            if wait > 0:
+                return wait
+        return 0.0
+
+
+def build_rate_limit_backend(name: str = RATE_LIMIT_BACKEND):
+    if name == "none":
+        return None
+    if name == "redis":
+        # redis — необязательная зависимость, нужна только для этого бэкенда
+        import redis.asyncio as redis
+        return RedisRateLimiter(redis.Redis.from_url(REDIS_URL))
+    return MemoryRateLimiter()
+
+
+rate_limiter = RateLimiter(build_rate_limit_backend())
+
+
+# Ограничение одновременно выполняющихся запросов. Освободившийся слот передаётся
+# первому ожидающему; ожидающих не больше queue_size, и каждый ждёт не дольше
+# timeout, поэтому при перегрузке лишние запросы быстро получают отказ, а не
+# копятся в очереди пула соединений вместе с чтением. Запросы могут выполняться в
+# разных циклах событий (потоках), поэтому ожидающий будится через call_soon_threadsafe.
+class ConcurrencyGate:
+    def __init__(self, limit: int, queue_size: int, timeout: float):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    # True, если слот получен; False — очередь полна или ожидание истекло
+    async def acquire(self) -> bool:
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return True
+            if len(self._waiters) >= self.queue_size or self.timeout <= 0:
+                return False
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            self._waiters.append((loop, waiter))
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+            return True
+        except asyncio.TimeoutError:
+            with self._lock:
+                if (loop, waiter) in self._waiters:
+                    self._waiters.remove((loop, waiter))
+            # Если слот уже передан этому запросу, его освободит _grant
+            return False
+
+    def release(self) -> None:
+        with self._lock:
+            if not self._waiters:
+                self.active -= 1
+                return
+            loop, waiter = self._waiters.popleft()
+        try:
+            loop.call_soon_threadsafe(self._grant, waiter)
+        except RuntimeError:
+            # Цикл ожидающего уже закрыт
+            self.release()
+
+    def _grant(self, waiter: asyncio.Future) -> None:
+        if waiter.done():
+            self.release()
+        else:
+            waiter.set_result(True)
+
+
+order_write_gate = ConcurrencyGate(ORDER_WRITE_CONCURRENCY, ORDER_WRITE_QUEUE_SIZE, ORDER_WRITE_QUEUE_TIMEOUT)
+
+
+def client_id(request: Request) -> str:
+    if RATE_LIMIT_CLIENT_HEADER:
+        value = request.headers.get(RATE_LIMIT_CLIENT_HEADER)
+        if value:
+            return value.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def retry_after(seconds: float) -> dict:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+
+# Зависимость эндпоинтов записи: 429 с Retry-After при превышении частоты
+async def limit_write_rate(request: Request) -> None:
+    wait = await rate_limiter.check(client_id(request))
+    if wait > 0:
+        metrics.ADMISSION_REJECTIONS.labels("rate_limit").inc()
+        raise HTTPException(status_code=429, detail="Too Many Requests", headers=retry_after(wait))
+
+
+# Зависимость записи заказов: слот на всё время запроса (до фиксации транзакции)
+# или 503 с Retry-After, если все слоты и очередь заняты
+async def order_write_slot():
+    gate = order_write_gate
+    if not await gate.acquire():
+        metrics.ADMISSION_REJECTIONS.labels("order_write_overload").inc()
+        raise HTTPException(status_code=503, detail="Order service is overloaded", headers=retry_after(ORDER_WRITE_RETRY_AFTER))
+    try:
+        yield
+    finally:
+        gate.release()
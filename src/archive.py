@@ -0,0 +1,131 @@
+import logging
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import List
+
+from sqlalchemy import DateTime, bindparam, delete, insert, literal, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem, StockMovement
+
+# Возраст в днях, после которого доставленный заказ переносится в архив, размер
+# пачки (одна транзакция) и период фоновой задачи архивации в секундах
+ORDER_ARCHIVE_AFTER_DAYS = int(os.getenv("ORDER_ARCHIVE_AFTER_DAYS", "180"))
+ORDER_ARCHIVE_BATCH_SIZE = int(os.getenv("ORDER_ARCHIVE_BATCH_SIZE", "1000"))
+ORDER_ARCHIVE_INTERVAL = float(os.getenv("ORDER_ARCHIVE_INTERVAL", "3600"))
+# Список заказов без include_archived и created_from показывает только заказы
+# за последние ORDERS_RECENT_DAYS дней, то есть читает только свежие секции
+ORDERS_RECENT_DAYS = int(os.getenv("ORDERS_RECENT_DAYS", "90"))
+# На сколько месяцев вперёд создаются секции orders и order_items
+ORDER_PARTITIONS_AHEAD = int(os.getenv("ORDER_PARTITIONS_AHEAD", "3"))
+
+DELIVERED_ORDER_STATUS = "доставлен"
+PARTITIONED_TABLES = ("orders", "order_items")
+
+logger = logging.getLogger("warehouse.archive")
+
+orders = Order.__table__
+order_items = OrderItem.__table__
+
+
+# Начало окна списка заказов по умолчанию
+def recent_orders_cutoff() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=ORDERS_RECENT_DAYS)
+
+
+# Таблицы, из которых читаются заказы: (модель заказа, модель позиции) —
+# рабочие таблицы и, по запросу, архив
+def order_sources(include_archived: bool) -> list:
+    sources = [(Order, OrderItem)]
+    if include_archived:
+        sources.append((ArchivedOrder, ArchivedOrderItem))
+    return sources
+
+
+def next_month(month: date) -> date:
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+# Создание месячных секций orders и order_items с текущего месяца на months_ahead
+# месяцев вперёд. Строки без своей секции попадают в секцию DEFAULT, а секцию нельзя
+# создать, если в DEFAULT уже есть строки её месяца, поэтому секции создаются заранее.
+# Создание секции ненадолго блокирует таблицу, поэтому выполняется, только если
+# секции ещё нет. Для несекционированных таблиц (create_all, SQLite) ничего не делает.
+# Возвращает имена созданных секций.
+async def ensure_partitions(db: AsyncSession, months_ahead: int = ORDER_PARTITIONS_AHEAD) -> List[str]:
+    if db.get_bind().dialect.name != "postgresql":
+        return []
+    partitioned = set((await db.execute(
+        text(
+            "SELECT c.relname FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname IN :tables AND pg_table_is_visible(c.oid)"
+        ).bindparams(bindparam("tables", expanding=True)),
+        {"tables": list(PARTITIONED_TABLES)},
+    )).scalars())
+
+    created = []
+    month = datetime.now(timezone.utc).date().replace(day=1)
+    for _ in range(months_ahead + 1):
+        following = next_month(month)
+        for table in PARTITIONED_TABLES:
+            name = f"{table}_{month:%Y_%m}"
+            if table not in partitioned or await db.scalar(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}):
+                continue
+            await db.execute(text(
+                f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ('{month}') TO ('{following}')"
+            ))
+            created.append(name)
+        month = following
+    await db.commit()
+    return created
+
+
+# Перенос доставленных заказов старше after_days в архив пачками по batch_size,
+# каждая пачка — в своей транзакции: заказы и позиции копируются в архивные таблицы
+# и удаляются из рабочих вместе с движениями журнала остатков (резерв доставленного
+# заказа больше не меняется). Условие по created_at оставляет запросам только
+# старые секции. Сводки отчётов не меняются: архивные заказы в них остаются.
+# Возвращает количество перенесённых заказов.
+async def archive_orders(
+    db: AsyncSession, after_days: int = ORDER_ARCHIVE_AFTER_DAYS, batch_size: int = ORDER_ARCHIVE_BATCH_SIZE
+) -> int:
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    cutoff = now - timedelta(days=after_days)
+    archived = 0
+    while True:
+        order_ids = (await db.execute(
+            select(orders.c.id)
+            .where(orders.c.status == DELIVERED_ORDER_STATUS, orders.c.created_at < cutoff)
+            .order_by(orders.c.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )).scalars().all()
+        if not order_ids:
+            await db.rollback()
+            return archived
+
+        in_orders = (orders.c.id.in_(order_ids), orders.c.created_at < cutoff)
+        in_items = (order_items.c.order_id.in_(order_ids), order_items.c.created_at < cutoff)
+        await db.execute(insert(ArchivedOrder).from_select(
+            [*orders.c.keys(), "archived_at"], select(*orders.c, literal(now, DateTime)).where(*in_orders)
+        ))
+        await db.execute(insert(ArchivedOrderItem).from_select(
+            order_items.c.keys(), select(*order_items.c).where(*in_items)
+        ))
+        await db.execute(delete(StockMovement).where(StockMovement.order_id.in_(order_ids)))
+        await db.execute(delete(order_items).where(*in_items))
+        await db.execute(delete(orders).where(*in_orders))
+        await db.commit()
+        archived += len(order_ids)
+
+
+# Фоновое обслуживание заказов: новые секции и перенос старых заказов в архив.
+# Шаги независимы: ошибка одного откатывает только его транзакцию и журналируется,
+# поэтому сбой создания секций не останавливает архивацию и наоборот
+async def maintain_orders(db: AsyncSession) -> None:
+    for step, name in ((ensure_partitions, "Order partition creation"), (archive_orders, "Order archival")):
+        try:
+            await step(db)
+        except Exception:
+            await db.rollback()
+            logger.exception("%s failed", name)
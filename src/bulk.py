@@ -0,0 +1,178 @@
+import codecs
+import csv
+import io
+import json
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import product_cache
+from . import events
+from .models import Product
+from .schemas import ProductImport
+from .stock import available_quantity, reset_stock
+
+# Количество строк в одном INSERT ... ON CONFLICT при импорте
+IMPORT_BATCH_SIZE = 1000
+# Количество строк, забираемых за раз из серверного курсора при экспорте
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_COLUMNS = ("id", "name", "description", "price", "quantity")
+UPSERT_COLUMNS = ("name", "description", "price", "quantity")
+
+# Последовательность id товаров в PostgreSQL не знает о явно вставленных id:
+# она сдвигается за наибольший из них, иначе следующий товар без id получил бы
+# занятый id. Назад последовательность не сдвигается, чтобы не выдать id,
+# уже полученные параллельными транзакциями.
+ADVANCE_PRODUCT_ID_SEQUENCE = text(
+    "SELECT setval(pg_get_serial_sequence('products', 'id'), :max_id) "
+    "WHERE :max_id > coalesce(pg_sequence_last_value(pg_get_serial_sequence('products', 'id')), 0)"
+)
+
+
+# Разбиение потока байтов на строки без чтения всего тела в память
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+def format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in error.errors()
+    )
+
+
+# Разбор строк NDJSON или CSV (с заголовком) в проверенные записи.
+# Возвращает пары (номер строки, запись или текст ошибки).
+# Поля CSV с переводом строки внутри кавычек не поддерживаются.
+async def parse_rows(lines: AsyncIterator[str], fmt: str) -> AsyncIterator[Tuple[int, object]]:
+    header: Optional[List[str]] = None
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if not line.strip():
+            continue
+
+        try:
+            if fmt == "csv":
+                values = next(csv.reader([line]))
+                if header is None:
+                    header = [column.strip() for column in values]
+                    continue
+                if len(values) != len(header):
+                    raise ValueError(f"expected {len(header)} columns, got {len(values)}")
+                # Пустые значения в CSV означают отсутствие значения
+                raw = {column: value for column, value in zip(header, values) if value != ""}
+            else:
+                raw = json.loads(line)
+                if not isinstance(raw, dict):
+                    raise ValueError("expected a JSON object")
+            yield line_number, ProductImport.parse_obj(raw).dict()
+        except ValidationError as e:
+            yield line_number, format_validation_error(e)
+        except ValueError as e:
+            yield line_number, str(e)
+
+
+# Вставка или обновление пачки товаров: строки с id обновляются через
+# INSERT ... ON CONFLICT (id) DO UPDATE, строки без id просто вставляются.
+# Остаток обновлённых товаров задаётся заново, поэтому их шарды сбрасываются.
+# Возвращает id обновлённых товаров.
+async def upsert_products(db: AsyncSession, rows: List[dict]) -> List[int]:
+    with_id: Dict[int, dict] = {}
+    without_id = []
+    for row in rows:
+        if row["id"] is None:
+            without_id.append({column: row[column] for column in UPSERT_COLUMNS})
+        else:
+            # Одна строка не может быть обновлена дважды в одном запросе — побеждает последняя
+            with_id[row["id"]] = row
+
+    if with_id:
+        await reset_stock(db, with_id)
+        dialect = sqlite if db.get_bind().dialect.name == "sqlite" else postgresql
+        statement = dialect.insert(Product).values(list(with_id.values()))
+        statement = statement.on_conflict_do_update(
+            index_elements=[Product.id],
+            set_={
+                **{column: statement.excluded[column] for column in UPSERT_COLUMNS},
+                "version": Product.__table__.c.version + 1,
+            },
+        )
+        await db.execute(statement)
+        if dialect is postgresql:
+            await db.execute(ADVANCE_PRODUCT_ID_SEQUENCE, {"max_id": max(with_id)})
+    if without_id:
+        await db.execute(insert(Product), without_id)
+    return list(with_id)
+
+
+# Импорт потока строк пачками по IMPORT_BATCH_SIZE. Каждая пачка фиксируется
+# отдельно, поэтому ошибка базы данных отменяет только свою пачку.
+async def import_products(db: AsyncSession, lines: AsyncIterator[str], fmt: str) -> dict:
+    result = {"processed": 0, "upserted": 0, "errors": []}
+    batch: List[Tuple[int, dict]] = []
+
+    async def flush():
+        try:
+            updated_ids = await upsert_products(db, [row for _, row in batch])
+            await events.broker.publish(db, events.stock_events(updated_ids))
+            await db.commit()
+            await product_cache.invalidate(updated_ids)
+            result["upserted"] += len(batch)
+        except SQLAlchemyError as e:
+            await db.rollback()
+            message = str(getattr(e, "orig", None) or e)
+            result["errors"].extend({"line": line, "error": message} for line, _ in batch)
+        batch.clear()
+
+    async for line, row in parse_rows(lines, fmt):
+        result["processed"] += 1
+        if isinstance(row, str):
+            result["errors"].append({"line": line, "error": row})
+            continue
+        batch.append((line, row))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await flush()
+    if batch:
+        await flush()
+
+    return result
+
+
+# Потоковая выгрузка товаров через серверный курсор: в памяти не более одной пачки строк
+async def export_products(db: AsyncSession, fmt: str) -> AsyncIterator[str]:
+    columns = [
+        available_quantity().label(column) if column == "quantity" else getattr(Product, column)
+        for column in EXPORT_COLUMNS
+    ]
+    result = await db.stream(
+        select(*columns).order_by(Product.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        yield buffer.getvalue()
+
+    async for partition in result.mappings().partitions():
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerows([row[column] for column in EXPORT_COLUMNS] for row in partition)
+            yield buffer.getvalue()
+        else:
+            yield "".join(json.dumps(dict(row), ensure_ascii=False) + "\n" for row in partition)
@@ -0,0 +1,150 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Iterable, Optional
+
+# Настройки кэша товаров: бэкенд (memory, redis или none), размер и время жизни записей
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+# Кэш в памяти процесса: LRU с ограничением по размеру и временем жизни записей.
+# Счётчики поколений хранятся отдельно и не вытесняются, иначе после вытеснения
+# счётчик начался бы заново и снова указал бы на устаревшую запись.
+class LRUCache:
+    def __init__(self, max_size: int = CACHE_MAX_SIZE, ttl: float = CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._counters = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    async def set(self, key: str, value) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    async def counter(self, key: str) -> int:
+        return self._counters.get(key, 0)
+
+    async def incr(self, key: str) -> int:
+        self._counters[key] = self._counters.get(key, 0) + 1
+        return self._counters[key]
+
+    async def stats(self) -> dict:
+        return {"backend": "memory", "size": len(self._entries), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+
+# Кэш в Redis (redis.asyncio или совместимый клиент, например fakeredis).
+# Вытеснением занимается сам Redis, поэтому счётчик вытеснений берётся из INFO.
+class RedisCache:
+    def __init__(self, client, ttl: float = CACHE_TTL, prefix: str = "warehouse:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str):
+        raw = await self.client.get(self.prefix + key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    async def set(self, key: str, value) -> None:
+        await self.client.set(self.prefix + key, json.dumps(value), px=int(self.ttl * 1000))
+
+    async def delete(self, key: str) -> None:
+        await self.client.delete(self.prefix + key)
+
+    async def counter(self, key: str) -> int:
+        return int(await self.client.get(self.prefix + key) or 0)
+
+    async def incr(self, key: str) -> int:
+        return await self.client.incr(self.prefix + key)
+
+    async def stats(self) -> dict:
+        info = await self.client.info("stats")
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses,
+                "evictions": int(info.get("evicted_keys", 0))}
+
+
+# Сквозной (read-through) кэш товаров и страниц списка товаров.
+# Ключ записи включает номер поколения: запись товара инвалидируется увеличением
+# его поколения, а все страницы списка — увеличением общего поколения списка.
+# Чтение, начатое до изменения, сохраняет результат под старым поколением,
+# которое уже никто не читает, поэтому устаревшие данные не возвращаются.
+class ProductCache:
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def _read_through(self, key: str, loader: Callable[[], Awaitable[Optional[dict]]]):
+        if self.backend is None:
+            return await loader()
+        value = await self.backend.get(key)
+        if value is not None:
+            return value
+        value = await loader()
+        if value is not None:
+            await self.backend.set(key, value)
+        return value
+
+    async def product(self, product_id: int, loader):
+        generation = await self.backend.counter(f"product:{product_id}:gen") if self.backend else 0
+        return await self._read_through(f"product:{product_id}:{generation}", loader)
+
+    async def listing(self, params: dict, loader):
+        generation = await self.backend.counter("products:gen") if self.backend else 0
+        key = f"products:{generation}:{json.dumps(params, sort_keys=True, default=str)}"
+        return await self._read_through(key, loader)
+
+    async def invalidate(self, product_ids: Iterable[int] = ()) -> None:
+        if self.backend is None:
+            return
+        for product_id in set(product_ids):
+            old_generation = await self.backend.counter(f"product:{product_id}:gen")
+            await self.backend.incr(f"product:{product_id}:gen")
+            await self.backend.delete(f"product:{product_id}:{old_generation}")
+        await self.backend.incr("products:gen")
+
+    async def stats(self) -> dict:
+        if self.backend is None:
+            return {"backend": "none"}
+        return await self.backend.stats()
+
+
+def build_cache_backend(name: str = CACHE_BACKEND):
+    if name == "none":
+        return None
+    if name == "redis":
+        # redis — необязательная зависимость, нужна только для этого бэкенда
+        import redis.asyncio as redis
+        return RedisCache(redis.Redis.from_url(REDIS_URL))
+    return LRUCache()
+
+
+product_cache = ProductCache(build_cache_backend())
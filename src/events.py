@@ -0,0 +1,230 @@
+import asyncio
+import json
+import os
+from typing import Iterable, List, Optional
+
+from sqlalchemy import bindparam, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .database import SQLALCHEMY_DATABASE_URL, database_urls
+
+# Бэкенд рассылки событий (postgres — LISTEN/NOTIFY между всеми процессами,
+# memory — только внутри процесса), размер очереди подписчика и период
+# пустых сообщений, по которым обнаруживается отключение клиента
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "postgres" if SQLALCHEMY_DATABASE_URL.startswith("postgresql") else "memory")
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "1000"))
+EVENTS_KEEPALIVE_INTERVAL = float(os.getenv("EVENTS_KEEPALIVE_INTERVAL", "15"))
+# Пауза перед переподключением клиента SSE в миллисекундах
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", "3000"))
+EVENTS_CHANNEL = "warehouse_events"
+
+PENDING_EVENTS = "pending_events"
+
+
+def order_event(order_id: int, status: str) -> dict:
+    return {"type": "order", "order_id": order_id, "status": status}
+
+
+def stock_events(product_ids: Iterable[int]) -> List[dict]:
+    return [{"type": "stock", "product_id": product_id} for product_id in sorted(set(product_ids))]
+
+
+# Подписчик потока событий с фильтром: типы событий, id заказов и товаров.
+# Очередь ограничена: если клиент не успевает читать, подписка помечается
+# переполненной и поток закрывается, а клиент переподключается и перечитывает
+# данные, вместо того чтобы копить события в памяти сервера.
+class Subscription:
+    def __init__(self, types=None, order_ids=None, product_ids=None, max_size: int = EVENTS_QUEUE_SIZE):
+        self.types = set(types) if types else None
+        self.order_ids = set(order_ids) if order_ids else None
+        self.product_ids = set(product_ids) if product_ids else None
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.loop = asyncio.get_running_loop()
+        self.overflowed = False
+        self.closed = False
+
+    def matches(self, item: dict) -> bool:
+        if self.types is not None and item["type"] not in self.types:
+            return False
+        if item["type"] == "order":
+            return self.order_ids is None or item["order_id"] in self.order_ids
+        return self.product_ids is None or item["product_id"] in self.product_ids
+
+    def put(self, item: dict) -> None:
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    # Закрытие потока сервером (события перестали приходить): читатель будится
+    # пустым сообщением, а клиент переподключается
+    def close(self) -> None:
+        self.closed = True
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+
+# Рассылка событий подписчикам процесса. События публикуются в транзакции,
+# которая их вызвала, и доходят до подписчиков только после её фиксации.
+class MemoryBroker:
+    def __init__(self):
+        self.subscribers = set()
+
+    async def subscribe(self, subscription: Subscription) -> None:
+        self.subscribers.add(subscription)
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.subscribers.discard(subscription)
+
+    # Подписчик может читать поток в другом цикле событий (другом потоке),
+    # поэтому событие передаётся в его цикл через call_soon_threadsafe
+    def deliver(self, items: List[dict]) -> None:
+        for subscription in list(self.subscribers):
+            matching = [item for item in items if subscription.matches(item)]
+            if not matching:
+                continue
+            try:
+                for item in matching:
+                    subscription.loop.call_soon_threadsafe(subscription.put, item)
+            except RuntimeError:
+                # Цикл подписчика уже закрыт
+                self.unsubscribe(subscription)
+
+    async def publish(self, db: AsyncSession, items: List[dict]) -> None:
+        if items:
+            db.sync_session.info.setdefault(PENDING_EVENTS, []).extend(items)
+
+
+# Рассылка через PostgreSQL: NOTIFY выполняется в транзакции изменения (и
+# отменяется вместе с ней), а каждый процесс приложения держит одно соединение
+# с LISTEN и раздаёт полученные события своим подписчикам.
+class PostgresBroker(MemoryBroker):
+    notify = text(
+        f"SELECT pg_notify('{EVENTS_CHANNEL}', payload) FROM unnest(CAST(:payloads AS text[])) AS payload"
+    ).bindparams(bindparam("payloads"))
+
+    # Без url слушается основная база приложения (database_urls на момент подписки)
+    def __init__(self, url: Optional[str] = None):
+        super().__init__()
+        self.url = url
+        self.connection = None
+        self.loop = None
+        self.lock = None
+        self.lock_loop = None
+
+    async def subscribe(self, subscription: Subscription) -> None:
+        await self.listen()
+        await super().subscribe(subscription)
+
+    def listening(self, loop) -> bool:
+        return self.connection is not None and not self.connection.is_closed() and self.loop is loop
+
+    # Соединение с LISTEN открывается при первой подписке и заново, если оно
+    # закрылось или было открыто в уже завершённом цикле событий. Одновременные
+    # первые подписки (переподключение всех клиентов) ждут одно открытие под
+    # блокировкой, иначе каждая открыла бы своё соединение и события дублировались бы.
+    async def listen(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self.listening(loop):
+            return
+        if self.lock is None or self.lock_loop is not loop:
+            self.lock, self.lock_loop = asyncio.Lock(), loop
+        async with self.lock:
+            if self.listening(loop):
+                return
+            import asyncpg
+
+            self.close_connection()
+            url = make_url(self.url or database_urls["primary"]).set(drivername="postgresql")
+            connection = await asyncpg.connect(url.render_as_string(hide_password=False))
+            await connection.add_listener(EVENTS_CHANNEL, self.on_notification)
+            connection.add_termination_listener(self.on_connection_lost)
+            self.connection, self.loop = connection, loop
+
+    # Прежнее соединение закрывается в своём цикле событий, если он ещё работает
+    def close_connection(self) -> None:
+        connection, self.connection = self.connection, None
+        if connection is None or connection.is_closed():
+            return
+        try:
+            self.loop.call_soon_threadsafe(connection.terminate)
+        except RuntimeError:
+            # Цикл соединения уже закрыт
+            pass
+
+    def on_notification(self, connection, pid, channel, payload) -> None:
+        self.deliver([json.loads(payload)])
+
+    # Соединение с LISTEN разорвано: события, пришедшие до переподключения, были
+    # бы потеряны, поэтому потоки подписчиков закрываются, а клиенты переподключаются
+    # (соединение открывается заново при следующей подписке) и перечитывают данные
+    def on_connection_lost(self, connection) -> None:
+        if connection is not self.connection:
+            return
+        self.connection = None
+        for subscription in list(self.subscribers):
+            self.unsubscribe(subscription)
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.close)
+            except RuntimeError:
+                pass
+
+    async def publish(self, db: AsyncSession, items: List[dict]) -> None:
+        if items:
+            await db.execute(self.notify, {"payloads": [json.dumps(item, ensure_ascii=False) for item in items]})
+
+
+def build_broker(name: str = EVENTS_BACKEND):
+    if name == "postgres":
+        return PostgresBroker()
+    return MemoryBroker()
+
+
+broker = build_broker()
+
+
+# События бэкенда memory отправляются только после фиксации транзакции
+@event.listens_for(Session, "after_commit")
+def deliver_pending_events(session):
+    items = session.info.pop(PENDING_EVENTS, None)
+    if items:
+        broker.deliver(items)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_pending_events(session):
+    session.info.pop(PENDING_EVENTS, None)
+
+
+def format_sse(item: Optional[dict]) -> str:
+    if item is None:
+        return ": keepalive\n\n"
+    return f"event: {item['type']}\ndata: {json.dumps(item, ensure_ascii=False)}\n\n"
+
+
+# Поток Server-Sent Events для подписчика. Первое сообщение (пауза переподключения)
+# отправляется уже после подписки. При переполнении очереди поток завершается
+# событием overflow (очередь переполняется, только когда в ней есть события,
+# поэтому читатель в этот момент не ждёт и сразу видит флаг), а при закрытии
+# подписки сервером — без сообщения.
+async def stream_events(subscription: Subscription):
+    await broker.subscribe(subscription)
+    try:
+        yield f"retry: {EVENTS_RETRY_MS}\n\n"
+        while True:
+            try:
+                item = await asyncio.wait_for(subscription.queue.get(), EVENTS_KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                item = None
+            if subscription.closed:
+                return
+            if subscription.overflowed:
+                yield format_sse({"type": "overflow"})
+                return
+            yield format_sse(item)
+    finally:
+        broker.unsubscribe(subscription)
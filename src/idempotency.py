@@ -0,0 +1,81 @@
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import IdempotencyKey
+
+# Время жизни ключа идемпотентности в секундах и период удаления просроченных ключей
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "3600"))
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+keys = IdempotencyKey.__table__
+
+
+def expiry_cutoff() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=IDEMPOTENCY_KEY_TTL)
+
+
+async def request_fingerprint(request: Request) -> str:
+    digest = hashlib.sha256(f"{request.method} {request.url.path}\n".encode())
+    digest.update(await request.body())
+    return digest.hexdigest()
+
+
+# Захват ключа идемпотентности. Должен быть первым запросом транзакции: строка ключа
+# вставляется сразу, поэтому параллельный запрос с тем же ключом ждёт на уникальном
+# индексе, пока первый не зафиксирует транзакцию (и тогда получает его ответ)
+# или не откатит её (и тогда выполняет работу сам). Ответ сохраняется через
+# save_response в той же транзакции, что и созданные запросом данные, поэтому
+# сохранённый ключ всегда означает выполненную работу, а ошибка не сохраняется
+# и повтор запроса выполняет его заново.
+# Возвращает сохранённый ответ для повтора или None, если ключ захвачен этим запросом.
+async def claim_key(db: AsyncSession, key: str, request: Request) -> Optional[JSONResponse]:
+    if not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{MAX_IDEMPOTENCY_KEY_LENGTH} characters")
+    fingerprint = await request_fingerprint(request)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    # Просроченный, но ещё не удалённый ключ захватывается заново
+    dialect = sqlite if db.get_bind().dialect.name == "sqlite" else postgresql
+    while True:
+        statement = dialect.insert(keys).values(key=key, fingerprint=fingerprint, created_at=now)
+        statement = statement.on_conflict_do_update(
+            index_elements=[keys.c.key],
+            set_={"fingerprint": fingerprint, "created_at": now, "status_code": None, "response": None},
+            where=keys.c.created_at < expiry_cutoff(),
+        ).returning(keys.c.key)
+        if (await db.execute(statement)).first() is not None:
+            return None
+
+        stored = (await db.execute(
+            select(keys.c.fingerprint, keys.c.status_code, keys.c.response).where(keys.c.key == key)
+        )).first()
+        # Ключ успели удалить (истёк и удалён purge_expired_keys) между вставкой
+        # и чтением — гонка проиграна, ключ захватывается заново
+        if stored is not None:
+            break
+    if stored.fingerprint != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    return JSONResponse(stored.response, status_code=stored.status_code, headers={"Idempotent-Replayed": "true"})
+
+# Сохранение ответа под захваченным ключом (до фиксации транзакции)
+async def save_response(db: AsyncSession, key: str, status_code: int, body) -> None:
+    await db.execute(
+        update(keys).where(keys.c.key == key).values(status_code=status_code, response=jsonable_encoder(body))
+    )
+
+
+# Удаление просроченных ключей; возвращает количество удалённых
+async def purge_expired_keys(db: AsyncSession) -> int:
+    purged = (await db.execute(delete(keys).where(keys.c.created_at < expiry_cutoff()))).rowcount
+    await db.commit()
+    return purged
@@ -1,180 +1,944 @@
-from fastapi import FastAPI, Depends, HTTPException, Form, Request
-from sqlalchemy.orm import Session
-from datetime import datetime, timezone
+import asyncio
+import base64
+import hashlib
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional, Tuple
+
+import orjson
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Form, Request, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import select, insert, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from datetime import date, datetime, timedelta, timezone
 from .models import Product, Order, OrderItem
 from .schemas import ProductCreate, OrderCreate, OrderResponse
-from .database import SessionLocal, engine
+from .database import SessionLocal, database_urls, dispose_engines, get_db, get_read_db
+from .bulk import export_products, import_products, iter_lines
+from .cache import product_cache
+from .search import search_query
+from . import admission
+from . import archive
+from . import events
+from . import idempotency
+from . import order_queue
+from . import order_status
+from . import reports
+from . import stock
+from . import metrics
 from src import models
 from src import schemas
 
-models.Base.metadata.create_all(bind=engine)
+# Маршруты API; приложение собирается в create_app
+router = APIRouter()
+
+
+# Периодическая фоновая задача со своей сессией; ошибки только журналируются
+async def run_periodically(interval: float, job, name: str):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with SessionLocal() as db:
+                await job(db)
+        except Exception:
+            metrics.logger.exception("%s failed", name)
+
+
+# Фоновые задачи: уплотнение остатков товаров (снимок, шарды, журнал),
+# удаление просроченных ключей идемпотентности, обработка очереди заказов,
+# создание секций заказов и перенос старых заказов в архив
+def start_background_tasks() -> List[asyncio.Task]:
+    queue_interval = order_queue.ORDER_QUEUE_POLL_INTERVAL if order_queue.ORDER_QUEUE_IN_APP_WORKER else 0
+    return [
+        asyncio.create_task(run_periodically(interval, job, name))
+        for interval, job, name in (
+            (stock.STOCK_COMPACTION_INTERVAL, stock.compact_stock, "Stock compaction"),
+            (idempotency.IDEMPOTENCY_PURGE_INTERVAL, idempotency.purge_expired_keys, "Idempotency key purge"),
+            (queue_interval, order_queue.drain_order_queue, "Order queue processing"),
+            (archive.ORDER_ARCHIVE_INTERVAL, archive.maintain_orders, "Order archival"),
+        )
+        if interval > 0
+    ]
+
+
+# Метрики запроса: задержка по маршруту, число и время SQL-запросов, ожидание пула
+async def record_request_metrics(request: Request, call_next):
+    stats = metrics.RequestStats()
+    token = metrics.request_stats.set(stats)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        metrics.request_stats.reset(token)
+    elapsed = time.perf_counter() - started
+
+    route = request.scope.get("route")
+    metrics.observe_request(request.method, route.path if route else "unmatched", response.status_code, elapsed, stats)
+    if metrics.METRICS_SERVER_TIMING:
+        response.headers["Server-Timing"] = metrics.server_timing(elapsed, stats)
+    return response
+
+
+# Метрики в формате Prometheus
+@router.get("/metrics")
+async def get_metrics():
+    return Response(metrics.render_metrics(), media_type=metrics.CONTENT_TYPE)
+
+# Допуск запросов на запись: ограничение частоты (429) для всех эндпоинтов записи
+# и, для записи заказов, ограничение одновременных запросов (503), чтобы всплеск
+# заказов не занимал весь пул соединений и не замедлял чтение
+WRITE_ADMISSION = [Depends(admission.limit_write_rate)]
+ORDER_WRITE_ADMISSION = [*WRITE_ADMISSION, Depends(admission.order_write_slot)]
+
+# Размер страницы для списков по умолчанию и его верхняя граница
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
+# Максимальное количество заказов в одном запросе POST /orders/batch
+MAX_ORDER_BATCH_SIZE = 500
+# Максимальное количество заказов, статус которых меняет один запрос PATCH /orders/status
+MAX_ORDER_STATUS_BATCH_SIZE = 5000
 
-app = FastAPI()
 
+# Курсор для keyset-пагинации: непрозрачный токен с id последней записи страницы
+# (для выдачи по релевантности, где нет устойчивого ключа, — со смещением)
+def encode_cursor(value: int, key: str = "id") -> str:
+    payload = json.dumps({key: value}).encode()
+    return base64.urlsafe_b64encode(payload).decode()
 
-def get_db():
-    db = SessionLocal()
+
+def decode_cursor(cursor: str, key: str = "id") -> int:
     try:
-        yield db
-    finally:
-        db.close()
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(payload[key])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# Курсор списка, отсортированного по сумме заказа: сумма и id последнего заказа
+def encode_total_cursor(total: float, order_id: int) -> str:
+    payload = json.dumps({"total": total, "id": order_id}).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+
+def decode_total_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(payload["total"]), int(payload["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# ETag строится из версий строк, поэтому совпадение можно проверить
+# до сериализации ответа (а для одной записи — и без чтения всей строки)
+def make_etag(*parts) -> str:
+    return '"' + hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest() + '"'
+
+
+def etag_matches(header: Optional[str], etag: str, weak: bool = True) -> bool:
+    if header is None:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    if weak:
+        # If-None-Match сравнивает теги слабо: W/"x" совпадает с "x"
+        candidates = [candidate[2:] if candidate.startswith("W/") else candidate for candidate in candidates]
+    return "*" in candidates or etag in candidates
+
+
+# Остаток меняется заказами без увеличения версии товара, поэтому входит в ETag
+def product_etag(product_id: int, version: int, quantity: int) -> str:
+    return make_etag("product", product_id, version, quantity)
+
+
+# Данные товаров в заказе — снимок на момент покупки, поэтому ETag заказа
+# зависит только от его версии
+def order_etag(order_id: int, version: int) -> str:
+    return make_etag("order", order_id, version)
+
+
+async def current_order_etag(db: AsyncSession, order_id: int) -> Optional[str]:
+    version = await db.scalar(select(Order.version).where(Order.id == order_id))
+    if version is None:
+        return None
+    return order_etag(order_id, version)
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+# Ответ для быстрого режима списков: данные из базы уже проверены,
+# поэтому они сериализуются orjson напрямую, без повторной проверки схемой
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+
+FAST_MODE_DESCRIPTION = "Быстрый режим: проекция колонок и orjson без проверки ответа схемой"
+
+PRODUCT_COLUMNS = (
+    Product.id, Product.name, Product.description, Product.price,
+    stock.available_quantity().label("quantity"), Product.version,
+)
 
 
 # 1. **Эндпоинты для товаров**:
-@app.post("/products/", response_model=schemas.Product, status_code=201)
-def create_product(product: schemas.ProductCreate, db: Session = Depends(get_db)):
+# С заголовком Idempotency-Key повтор запроса возвращает сохранённый ответ
+# и не создаёт товар ещё раз
+@router.post("/products/", response_model=schemas.Product, status_code=201, dependencies=WRITE_ADMISSION)
+async def create_product(product: schemas.ProductCreate, request: Request, db: AsyncSession = Depends(get_db)):
+    idempotency_key = request.headers.get("idempotency-key")
+    if idempotency_key is not None:
+        replay = await idempotency.claim_key(db, idempotency_key, request)
+        if replay is not None:
+            return replay
+
     db_product = models.Product(**product.dict())
     db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
+    if idempotency_key is not None:
+        await db.flush()
+        await idempotency.save_response(db, idempotency_key, 201, schemas.Product.model_validate(db_product))
+    await db.commit()
+    await db.refresh(db_product)
+    await product_cache.invalidate([db_product.id])
     return db_product
 
-# Получение всех продуктов
-@app.get("/products/")
-def get_products(request: Request, db: Session = Depends(get_db)):
-    return db.query(models.Product).all()
-
-# Получение информации о товаре по id
-@app.get("/products/{id}", response_model=schemas.Product)
-def get_product(id: int, db: Session = Depends(get_db)):
-    product = db.query(models.Product).filter(models.Product.id == id).first()  # Используйте .first()
+# Сессия для заполнения кэша товаров. Кэш общий для всех читателей, поэтому при
+# заданной реплике промах кэша читается с основной базы: строка с отстающей
+# реплики, сохранённая уже после сброса кэша, отдавалась бы до CACHE_TTL.
+@asynccontextmanager
+async def cache_fill_session(db: AsyncSession):
+    if database_urls["replica"] is None:
+        yield db
+    else:
+        async with SessionLocal() as primary:
+            yield primary
+
+# Получение списка продуктов постранично (keyset по id) с фильтрами.
+# Страницы кэшируются и сбрасываются при любом изменении товаров.
+@router.get("/products/", response_model=schemas.ProductPage)
+async def get_products(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    name: Optional[str] = Query(None, min_length=1, description="Префикс названия"),
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    in_stock: bool = False,
+    fast: bool = Query(False, description=FAST_MODE_DESCRIPTION),
+    db: AsyncSession = Depends(get_read_db),
+):
+    # Страница собирается из колонок, без ORM-объектов и identity map
+    query = select(*PRODUCT_COLUMNS)
+    if cursor is not None:
+        query = query.where(models.Product.id > decode_cursor(cursor))
+    if name is not None:
+        query = query.where(models.Product.name.startswith(name, autoescape=True))
+    if min_price is not None:
+        query = query.where(models.Product.price >= min_price)
+    if max_price is not None:
+        query = query.where(models.Product.price <= max_price)
+    if in_stock:
+        query = query.where(stock.available_quantity() > 0)
+
+    async def load_page():
+        # Берём на одну запись больше, чтобы узнать, есть ли следующая страница
+        async with cache_fill_session(db) as session:
+            result = await session.execute(query.order_by(models.Product.id).limit(limit + 1))
+            products = [dict(row) for row in result.mappings()]
+        next_cursor = None
+        if len(products) > limit:
+            products = products[:limit]
+            next_cursor = encode_cursor(products[-1]["id"])
+        return {"items": products, "next_cursor": next_cursor}
+
+    params = {"cursor": cursor, "limit": limit, "name": name, "min_price": min_price,
+              "max_price": max_price, "in_stock": in_stock}
+    page = await product_cache.listing(params, load_page)
+
+    etag = make_etag("products", [(item["id"], item["version"], item["quantity"]) for item in page["items"]], page["next_cursor"])
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    if fast:
+        return FastJSONResponse(page, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return page
+
+# Массовый импорт товаров из потока NDJSON или CSV (с заголовком)
+@router.post("/products/bulk", response_model=schemas.BulkImportResult, dependencies=WRITE_ADMISSION)
+async def bulk_import_products(request: Request, db: AsyncSession = Depends(get_db)):
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type == "text/csv":
+        fmt = "csv"
+    elif content_type in ("application/x-ndjson", "application/jsonl"):
+        fmt = "ndjson"
+    else:
+        raise HTTPException(status_code=415, detail=f"Unsupported content type: {content_type}")
+
+    return await import_products(db, iter_lines(request.stream()), fmt)
+
+# Потоковая выгрузка всех товаров в NDJSON или CSV
+@router.get("/products/export")
+async def export_products_stream(format: Literal["ndjson", "csv"] = "ndjson", db: AsyncSession = Depends(get_read_db)):
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(export_products(db, format), media_type=media_type)
+
+# Полнотекстовый поиск товаров по названию и описанию, по убыванию релевантности
+@router.get("/products/search", response_model=schemas.ProductPage)
+async def search_products(
+    q: str = Query(..., min_length=1, max_length=200),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    db: AsyncSession = Depends(get_read_db),
+):
+    offset = decode_cursor(cursor, "offset") if cursor is not None else 0
+    query = search_query(db.get_bind().dialect.name, q, PRODUCT_COLUMNS, offset, limit + 1)
+    products = [dict(row) for row in (await db.execute(query)).mappings()]
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        next_cursor = encode_cursor(offset + limit, "offset")
+    return {"items": products, "next_cursor": next_cursor}
+
+# Статистика кэша товаров: попадания, промахи и вытеснения
+@router.get("/cache/stats")
+async def get_cache_stats():
+    return await product_cache.stats()
+
+# Получение информации о товаре по id (через кэш).
+# При If-None-Match сначала читаются только версия и остаток товара.
+@router.get("/products/{id}", response_model=schemas.Product)
+async def get_product(id: int, request: Request, response: Response, db: AsyncSession = Depends(get_read_db)):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        current = (await db.execute(
+            select(Product.version, stock.available_quantity()).where(Product.id == id)
+        )).first()
+        if current is not None and etag_matches(if_none_match, product_etag(id, *current)):
+            return not_modified(product_etag(id, *current))
+
+    async def load_product():
+        async with cache_fill_session(db) as session:
+            product = (await session.execute(select(*PRODUCT_COLUMNS).where(Product.id == id))).mappings().first()
+        return dict(product) if product else None
+
+    product = await product_cache.product(id, load_product)
     if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
+    response.headers["ETag"] = product_etag(id, product["version"], product["quantity"])
     return product 
 
-# Обновление информации о товаре
-@app.put("/products/{id}")
-async def update_or_create_product(id: int, product_data: ProductCreate, request: Request, db: Session = Depends(get_db)):
-    db_product = db.query(Product).filter(Product.id == id).first()
+# Обновление информации о товаре.
+# С заголовком If-Match товар обновляется, только если его ETag не изменился.
+# Остаток задаётся заново, поэтому шарды остатка сбрасываются (до блокировки
+# строки товара — в том же порядке, что и при резервировании).
+@router.put("/products/{id}", dependencies=WRITE_ADMISSION)
+async def update_or_create_product(id: int, product_data: ProductCreate, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    if_match = request.headers.get("if-match")
+    shard_totals = await stock.reset_stock(db, [id])
+    query = select(Product).where(Product.id == id)
+    if if_match is not None:
+        query = query.with_for_update()
+    db_product = (await db.execute(query)).scalar_one_or_none()
+
+    if if_match is not None and (
+        db_product is None or not etag_matches(if_match, product_etag(id, db_product.version, shard_totals.get(id, db_product.quantity)), weak=False)
+    ):
+        await db.rollback()
+        raise HTTPException(status_code=412, detail="Precondition Failed")
     
     if db_product:
         db_product.name = product_data.name
         db_product.description = product_data.description
         db_product.price = product_data.price
         db_product.quantity = product_data.quantity
-        db.commit()
-        db.refresh(db_product)
+        db_product.version = Product.version + 1
+        await events.broker.publish(db, events.stock_events([id]))
+        await db.commit()
+        await db.refresh(db_product)
     else:
         new_product = Product(id=id, **product_data.dict())
         db.add(new_product)
-        db.commit()
-        db.refresh(new_product)
+        await events.broker.publish(db, events.stock_events([id]))
+        await db.commit()
+        await db.refresh(new_product)
         db_product = new_product
 
+    await product_cache.invalidate([id])
+    response.headers["ETag"] = product_etag(id, db_product.version, db_product.quantity)
     return db_product
 
 
-@app.delete("/products/{id}")
-def confirm_delete_product(request: Request, id: int, db: Session = Depends(get_db)):
-    product = db.query(Product).filter(Product.id == id).first()
+@router.delete("/products/{id}", dependencies=WRITE_ADMISSION)
+async def confirm_delete_product(request: Request, id: int, db: AsyncSession = Depends(get_db)):
+    product = await db.get(Product, id)
     
     if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
 
-    db.delete(product)
-    db.commit()
+    await db.delete(product)
+    await db.commit()
+    await product_cache.invalidate([id])
 
     return {"detail": "Product deleted successfully"}
 
 # 2. **Эндпоинты для заказов**:
 
-# Создание заказа с проверкой наличия товара на складе
-@app.post("/orders/", response_model=OrderResponse)
-def create_order(order: OrderCreate, db: Session = Depends(get_db)):
+# Суммарное запрошенное количество по каждому товару заказа
+def aggregate_items(order: OrderCreate) -> dict:
+    requested = {}
+    for item in order.items:
+        requested[item.product_id] = requested.get(item.product_id, 0) + item.quantity
+    return requested
+
+
+# Товары заказа (название для сообщений об ошибках и снимок в позициях заказа)
+# без блокировки строк товаров: остаток хранится в шардах и блокируется там
+async def load_products(db: AsyncSession, product_ids) -> dict:
+    if not product_ids:
+        return {}
+    result = await db.execute(
+        select(Product.id, Product.name, Product.description, Product.price).where(Product.id.in_(product_ids))
+    )
+    return {product.id: product for product in result}
+
+
+def require_products(requested: dict, products: dict) -> None:
+    for product_id in requested:
+        if product_id not in products:
+            raise HTTPException(status_code=404, detail=f"Product with id {product_id} not found")
+
+
+# Резервирование остатка под заказ: сначала проверяются все позиции,
+# затем уменьшаются остатки в available (словарь id товара -> количество)
+def reserve_stock(requested: dict, products: dict, available: dict) -> None:
+    require_products(requested, products)
+    for product_id, quantity in requested.items():
+        if available.get(product_id, 0) < quantity:
+            raise HTTPException(status_code=400, detail=f"Insufficient stock for product {products[product_id].name}")
+
+    for product_id, quantity in requested.items():
+        available[product_id] -= quantity
+
+
+# Вставка заказов и всех их позиций двумя запросами; возвращает id заказов и время создания.
+# Позиции получают снимок товара из products (результат load_products), заказ —
+# сумму по этим ценам и количество единиц товара.
+async def insert_orders(
+    db: AsyncSession, orders: List[OrderCreate], products: dict, status: str = reports.NEW_ORDER_STATUS
+) -> Tuple[List[int], datetime]:
+    # Колонка created_at без часового пояса: храним UTC как naive datetime
+    created_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    order_ids = (await db.execute(
+        insert(Order).returning(Order.id, sort_by_parameter_order=True),
+        [
+            {
+                "status": status,
+                "created_at": created_at,
+                "total": sum(products[item.product_id].price * item.quantity for item in order.items),
+                "item_count": sum(item.quantity for item in order.items),
+            }
+            for order in orders
+        ],
+    )).scalars().all()
+
+    items = [
+        {
+            "order_id": order_id,
+            "product_id": item.product_id,
+            "quantity": item.quantity,
+            "created_at": created_at,
+            "product_name": products[item.product_id].name,
+            "product_description": products[item.product_id].description,
+            "unit_price": products[item.product_id].price,
+        }
+        for order_id, order in zip(order_ids, orders)
+        for item in order.items
+    ]
+    if items:
+        await db.execute(insert(OrderItem), items)
+    return order_ids, created_at
+
+
+async def load_orders(db: AsyncSession, order_ids) -> dict:
+    result = await db.execute(
+        select(Order).options(selectinload(Order.items)).where(Order.id.in_(order_ids))
+    )
+    return {order.id: order for order in result.scalars()}
+
+
+# Создание заказа с проверкой наличия товара на складе.
+# Всё выполняется в одной транзакции. Заказ и позиции вставляются до резервирования,
+# чтобы шарды остатка оставались заблокированными только до фиксации транзакции.
+# С заголовком Idempotency-Key ответ сохраняется в той же транзакции, а повтор
+# запроса (в том числе параллельный) возвращает его без нового заказа и резерва.
+# С заголовком Prefer: respond-async заказ только проверяется и ставится в очередь:
+# ответ 202 с id заказа, остаток резервирует обработчик очереди, а результат виден
+# в статусе заказа (GET /orders/{id}).
+@router.post(
+    "/orders/",
+    response_model=OrderResponse,
+    responses={202: {"model": schemas.OrderAccepted}},
+    dependencies=ORDER_WRITE_ADMISSION,
+)
+async def create_order(order: OrderCreate, request: Request, db: AsyncSession = Depends(get_db)):
+    idempotency_key = request.headers.get("idempotency-key")
+    respond_async = "respond-async" in request.headers.get("prefer", "")
     try:
-        db_order = Order(status="в процессе", created_at=datetime.now(timezone.utc))
-        db.add(db_order)
-        db.commit()
-        db.refresh(db_order)
-
-        for item in order.items:
-            db_product = db.query(Product).filter(Product.id == item.product_id).first()
-            if db_product is None:
-                db.rollback()  # Откатить изменения в случае ошибки
-                raise HTTPException(status_code=404, detail=f"Product with id {item.product_id} not found")
-            if db_product.quantity < item.quantity:
-                db.rollback()  # Откатить изменения в случае ошибки
-                raise HTTPException(status_code=400, detail=f"Insufficient stock for product {db_product.name}")
-
-            db_product.quantity -= item.quantity
-            db.add(db_product)
-            db_order_item = OrderItem(product_id=item.product_id, order_id=db_order.id, quantity=item.quantity)
-            db.add(db_order_item)
-
-        db.commit()
-        db_order.status = "в процессе"  
-        db.commit()
-        db.refresh(db_order) 
+        if idempotency_key is not None:
+            replay = await idempotency.claim_key(db, idempotency_key, request)
+            if replay is not None:
+                return replay
+
+        requested = aggregate_items(order)
+        products = await load_products(db, requested)
+        require_products(requested, products)
+        if respond_async:
+            return await enqueue_order(db, order, products, idempotency_key)
+        order_ids, created_at = await insert_orders(db, [order], products)
+        shortage = await stock.reserve_order_stock(db, requested)
+        if shortage is not None:
+            raise HTTPException(status_code=400, detail=f"Insufficient stock for product {products[shortage].name}")
+        await stock.record_reservations(db, order_ids, [requested])
+        await reports.record_new_orders(db, order_ids, created_at, [requested])
+        await events.broker.publish(db, [
+            events.order_event(order_ids[0], reports.NEW_ORDER_STATUS), *events.stock_events(requested)
+        ])
+
+        if idempotency_key is not None:
+            db_order = (await load_orders(db, order_ids))[order_ids[0]]
+            await idempotency.save_response(db, idempotency_key, 200, OrderResponse.model_validate(db_order))
+        await db.commit()
+        await product_cache.invalidate(requested)
+        if idempotency_key is None:
+            db_order = (await load_orders(db, order_ids))[order_ids[0]]
 
     except HTTPException as e:
-        db.rollback()
+        await db.rollback()
         raise e
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
     return db_order
 
-# Получение списка заказов
-@app.get("/orders/")
-def get_orders(db: Session = Depends(get_db)):
-    orders = db.query(Order).all()
-    order_responses = []
-
-    for order in orders:
-        items = db.query(OrderItem).filter(OrderItem.order_id == order.id).all()
-        order_response = {
-            "id": order.id,
-            "created_at": order.created_at.isoformat(),
-            "status": order.status,
-            "items": [{"product_id": item.product_id, "quantity": item.quantity} for item in items]
-        }
-        order_responses.append(order_response)
+# Постановка проверенного заказа в очередь обработки
+async def enqueue_order(db: AsyncSession, order: OrderCreate, products: dict, idempotency_key: Optional[str]) -> Response:
+    order_ids, created_at = await insert_orders(db, [order], products, reports.QUEUED_ORDER_STATUS)
+    await order_queue.enqueue_orders(db, order_ids, created_at)
+    await events.broker.publish(db, [events.order_event(order_ids[0], reports.QUEUED_ORDER_STATUS)])
+    accepted = schemas.OrderAccepted(id=order_ids[0], status=reports.QUEUED_ORDER_STATUS)
+    if idempotency_key is not None:
+        await idempotency.save_response(db, idempotency_key, 202, accepted)
+    await db.commit()
+    return JSONResponse(
+        accepted.model_dump(),
+        status_code=202,
+        headers={"Location": f"/orders/{accepted.id}", "Preference-Applied": "respond-async"},
+    )
+
+
+# Создание пачки заказов в одной транзакции. Шарды остатка всех товаров пачки
+# блокируются и переписываются один раз, а заказ, которому не хватило товара,
+# не мешает остальным.
+@router.post("/orders/batch", response_model=List[schemas.OrderBatchResult], dependencies=ORDER_WRITE_ADMISSION)
+async def create_orders_batch(orders: List[OrderCreate], db: AsyncSession = Depends(get_db)):
+    if len(orders) > MAX_ORDER_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Too many orders in batch (max {MAX_ORDER_BATCH_SIZE})")
 
-    return order_responses
+    try:
+        requested_per_order = [aggregate_items(order) for order in orders]
+        products = await load_products(db, set().union(*requested_per_order))
+        available = await stock.lock_stock(db, products)
+
+        results = []
+        accepted = []
+        for index, requested in enumerate(requested_per_order):
+            try:
+                reserve_stock(requested, products, available)
+            except HTTPException as e:
+                results.append({"index": index, "status_code": e.status_code, "detail": e.detail})
+                continue
+            accepted.append(index)
+            results.append({"index": index, "status_code": 200})
+
+        if accepted:
+            reserved_ids = set().union(*(requested_per_order[index] for index in accepted))
+            await stock.write_stock(db, {product_id: available[product_id] for product_id in reserved_ids})
+            order_ids, created_at = await insert_orders(db, [orders[index] for index in accepted], products)
+            accepted_requested = [requested_per_order[index] for index in accepted]
+            await stock.record_reservations(db, order_ids, accepted_requested)
+            await reports.record_new_orders(db, order_ids, created_at, accepted_requested)
+            await events.broker.publish(db, [
+                *(events.order_event(order_id, reports.NEW_ORDER_STATUS) for order_id in order_ids),
+                *events.stock_events(reserved_ids),
+            ])
+            await db.commit()
+            await product_cache.invalidate(reserved_ids)
+
+            created = await load_orders(db, order_ids)
+            for index, order_id in zip(accepted, order_ids):
+                results[index]["order"] = created[order_id]
 
-# Получение информации о заказе по id
-@app.get("/orders/{id}")
-def get_order(id: int, db: Session = Depends(get_db)):
-    order = db.query(Order).filter(Order.id == id).first()
-    if order is None:
-        raise HTTPException(status_code=404, detail="Order not found")
+    except HTTPException as e:
+        await db.rollback()
+        raise e
+    except Exception:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Internal Server Error")
 
-    items = db.query(OrderItem).filter(OrderItem.order_id == order.id).all()
+    return results
+
+# Позиции заказов страницы в виде словарей, одним запросом по колонкам
+# (из таблицы позиций item_model: рабочей или архивной)
+async def project_order_items(db: AsyncSession, order_ids, item_model=OrderItem, items: Optional[dict] = None) -> dict:
+    items = items if items is not None else {order_id: [] for order_id in order_ids}
+    if order_ids:
+        result = await db.execute(
+            select(
+                item_model.order_id, item_model.id, item_model.product_id, item_model.quantity,
+                item_model.product_name, item_model.unit_price,
+            )
+            .where(item_model.order_id.in_(order_ids))
+            .order_by(item_model.id)
+        )
+        for order_id, item_id, product_id, quantity, product_name, unit_price in result:
+            items[order_id].append({
+                "id": item_id, "product_id": product_id, "quantity": quantity,
+                "product_name": product_name, "unit_price": unit_price,
+            })
+    return items
+
+
+INCLUDE_ARCHIVED_DESCRIPTION = "Вся история: заказы старше окна по умолчанию и архив доставленных заказов"
+
+
+# Получение списка заказов постранично с фильтрами: keyset по id или, при сортировке
+# по сумме (total — по возрастанию, -total — по убыванию), по (total, id) с индексом.
+# Позиции всех заказов страницы подгружаются одним запросом через selectinload,
+# а в быстром режиме заказы и позиции читаются колонками без ORM-объектов.
+# Без created_from читаются только заказы за последние ORDERS_RECENT_DAYS дней
+# (в секционированной таблице — только свежие секции); include_archived снимает
+# это окно и добавляет заказы из архива.
+@router.get("/orders/", response_model=schemas.OrderPage)
+async def get_orders(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    status: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    min_total: Optional[float] = Query(None, ge=0),
+    max_total: Optional[float] = Query(None, ge=0),
+    sort: Literal["id", "total", "-total"] = "id",
+    fast: bool = Query(False, description=FAST_MODE_DESCRIPTION),
+    include_archived: bool = Query(False, description=INCLUDE_ARCHIVED_DESCRIPTION),
+    db: AsyncSession = Depends(get_read_db),
+):
+    by_total = sort != "id"
+    descending = sort == "-total"
+    created_from, created_to = schemas.naive_utc(created_from), schemas.naive_utc(created_to)
+    after = None
+    if cursor is not None:
+        after = decode_total_cursor(cursor) if by_total else decode_cursor(cursor)
+    if created_from is None and not include_archived:
+        created_from = archive.recent_orders_cutoff()
+
+    sources = archive.order_sources(include_archived)
+    orders = []
+    for model, _ in sources:
+        conditions = []
+        if after is not None and by_total:
+            position = tuple_(model.total, model.id)
+            conditions.append(position < after if descending else position > after)
+        elif after is not None:
+            conditions.append(model.id > after)
+        if status is not None:
+            conditions.append(model.status == status)
+        if created_from is not None:
+            conditions.append(model.created_at >= created_from)
+        if created_to is not None:
+            conditions.append(model.created_at < created_to)
+        if min_total is not None:
+            conditions.append(model.total >= min_total)
+        if max_total is not None:
+            conditions.append(model.total <= max_total)
+
+        if fast:
+            query = select(
+                model.id, model.created_at, model.status, model.status_detail, model.version,
+                model.total, model.item_count,
+            )
+        else:
+            query = select(model).options(selectinload(model.items))
+        if by_total and descending:
+            order_by = (model.total.desc(), model.id.desc())
+        else:
+            order_by = (model.total, model.id) if by_total else (model.id,)
+        result = await db.execute(query.where(*conditions).order_by(*order_by).limit(limit + 1))
+        orders.extend(result.all() if fast else result.scalars().all())
+    # Страница из рабочих и архивных заказов — первые по порядку сортировки из обеих выборок
+    if len(sources) > 1:
+        sort_key = (lambda order: (order.total, order.id)) if by_total else (lambda order: order.id)
+        orders = sorted(orders, key=sort_key, reverse=descending)[:limit + 1]
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        last = orders[-1]
+        next_cursor = encode_total_cursor(last.total, last.id) if by_total else encode_cursor(last.id)
+
+    etag = make_etag("orders", [(order.id, order.version) for order in orders], next_cursor)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+
+    if fast:
+        order_ids = [order.id for order in orders]
+        items = None
+        for _, item_model in sources:
+            items = await project_order_items(db, order_ids, item_model, items)
+        page = {
+            "items": [{**order._asdict(), "items": items[order.id]} for order in orders],
+            "next_cursor": next_cursor,
+        }
+        return FastJSONResponse(page, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
+    return {"items": orders, "next_cursor": next_cursor}
+
+# Получение информации о заказе по id (в том числе архивного).
+# Товары показываются по снимку в позициях (цена — на момент покупки), поэтому
+# заказ читается без таблицы товаров. При If-None-Match сначала читается только
+# версия заказа.
+@router.get("/orders/{id}")
+async def get_order(id: int, request: Request, response: Response, db: AsyncSession = Depends(get_read_db)):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etag = await current_order_etag(db, id)
+        if etag is not None and etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
+    # Заказ, которого нет в рабочих таблицах, ищется в архиве
+    for model, _ in archive.order_sources(include_archived=True):
+        order = (await db.execute(
+            select(model).options(selectinload(model.items)).where(model.id == id)
+        )).scalar_one_or_none()
+        if order is not None:
+            break
+    else:
+        raise HTTPException(status_code=404, detail="Order not found")
 
     order_response = {
         "id": order.id,
         "created_at": order.created_at.isoformat(),
         "status": order.status,
-        "items": []
-    }
-
-    for item in items:
-        product = db.query(Product).filter(Product.id == item.product_id).first()
-        if product:
-            order_response["items"].append({
-                "product_id": product.id,
-                "product_name": product.name,  
-                "product_description": product.description,
+        "status_detail": order.status_detail,
+        "total": order.total,
+        "item_count": order.item_count,
+        "items": [
+            {
+                "product_id": item.product_id,
+                "product_name": item.product_name,
+                "product_description": item.product_description,
                 "quantity": item.quantity,
-                "price": product.price  
-            })
+                "price": item.unit_price,
+            }
+            for item in order.items
+        ],
+    }
 
+    response.headers["ETag"] = order_etag(order.id, order.version)
     return order_response
 
-# Обновление статуса заказа
+# Массовая смена статуса заказов по списку id или по отбору (статус, период
+# создания). Переходы проверяются по графу order_status.ORDER_STATUS_TRANSITIONS:
+# заказы меняются одним UPDATE ... WHERE id IN (...) AND status = <допустимый
+# прежний статус> RETURNING id на каждый прежний статус, остальные заказы
+# возвращаются в rejected с причиной. По отбору за один запрос обновляется не
+# больше MAX_ORDER_STATUS_BATCH_SIZE заказов, has_more — остались ещё.
+@router.patch("/orders/status", response_model=schemas.OrderStatusUpdateResult, dependencies=ORDER_WRITE_ADMISSION)
+async def update_orders_status(body: schemas.OrderStatusUpdate, db: AsyncSession = Depends(get_db)):
+    if (body.ids is None) == (body.filter is None):
+        raise HTTPException(status_code=422, detail="Either ids or filter is required")
+    if body.status not in order_status.SETTABLE_ORDER_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Invalid status: {body.status}")
+
+    has_more = False
+    unchanged = []
+    rejected = []
+    if body.ids is not None:
+        ids = sorted(set(body.ids))
+        if len(ids) > MAX_ORDER_STATUS_BATCH_SIZE:
+            raise HTTPException(status_code=413, detail=f"Too many orders (max {MAX_ORDER_STATUS_BATCH_SIZE})")
+        changed = await order_status.transition_orders(db, body.status, [Order.id.in_(ids)])
+        updated = {order_id for order_id, _, _ in changed}
+        skipped = [order_id for order_id in ids if order_id not in updated]
+        current = dict((await db.execute(select(Order.id, Order.status).where(Order.id.in_(skipped)))).all()) if skipped else {}
+        for order_id in skipped:
+            if order_id not in current:
+                rejected.append({"id": order_id, "detail": "Order not found"})
+            elif current[order_id] == body.status:
+                unchanged.append(order_id)
+            else:
+                detail = order_status.transition_error(current[order_id], body.status) or "Order status changed concurrently"
+                rejected.append({"id": order_id, "status": current[order_id], "detail": detail})
+    else:
+        conditions = []
+        if body.filter.status is not None:
+            conditions.append(Order.status == body.filter.status)
+        if body.filter.created_from is not None:
+            conditions.append(Order.created_at >= body.filter.created_from)
+        if body.filter.created_to is not None:
+            conditions.append(Order.created_at < body.filter.created_to)
+        changed = await order_status.transition_orders(db, body.status, conditions, limit=MAX_ORDER_STATUS_BATCH_SIZE)
+        if len(changed) == MAX_ORDER_STATUS_BATCH_SIZE:
+            remaining = select(Order.id).where(
+                *conditions, Order.status.in_(order_status.allowed_predecessors(body.status))
+            ).limit(1)
+            has_more = (await db.execute(remaining)).first() is not None
+
+    released = await order_status.apply_status_change(db, changed, body.status)
+    await db.commit()
+    if released:
+        await product_cache.invalidate(released)
+    return {
+        "status": body.status,
+        "updated": [order_id for order_id, _, _ in changed],
+        "unchanged": unchanged,
+        "rejected": rejected,
+        "has_more": has_more,
+    }
+
 
-@app.patch("/orders/{id}/status", response_model=OrderResponse)
-def update_order_status(id: int, status: str = Form(...), db: Session = Depends(get_db)):
-    order = db.query(Order).filter(Order.id == id).first()
+# Обновление статуса заказа по графу переходов (см. PATCH /orders/status);
+# повторная установка текущего статуса ничего не меняет (как unchanged в PATCH /orders/status).
+# С заголовком If-Match статус меняется, только если ETag заказа не изменился.
+@router.patch("/orders/{id}/status", response_model=OrderResponse, dependencies=ORDER_WRITE_ADMISSION)
+async def update_order_status(id: int, request: Request, response: Response, status: str = Form(...), db: AsyncSession = Depends(get_db)):
+    if_match = request.headers.get("if-match")
+    # Заказ блокируется, чтобы параллельные отмены не вернули резерв дважды
+    query = select(Order).options(selectinload(Order.items)).where(Order.id == id).with_for_update(of=Order)
+    order = (await db.execute(query)).scalar_one_or_none()
     if order is None:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    valid_statuses = ["в процессе", "отправлен", "доставлен"]
-    if status not in valid_statuses:
+    if if_match is not None and not etag_matches(if_match, await current_order_etag(db, id), weak=False):
+        await db.rollback()
+        raise HTTPException(status_code=412, detail="Precondition Failed")
+
+    if status not in order_status.SETTABLE_ORDER_STATUSES:
         raise HTTPException(status_code=400, detail=f"Invalid status: {status}")
 
-    order.status = status
-    db.commit()
-    db.refresh(order)
-    return order
\ No newline at end of file
+    released = []
+    if status != order.status:
+        detail = order_status.transition_error(order.status, status)
+        if detail is not None:
+            # Заказ из очереди ещё ничего не зарезервировал, его статус задаёт обработчик
+            status_code = 409 if order.status == reports.QUEUED_ORDER_STATUS else 400
+            raise HTTPException(status_code=status_code, detail=detail)
+        released = await order_status.apply_status_change(db, [(order.id, order.created_at, order.status)], status)
+        order.status = status
+        order.version = Order.version + 1
+    await db.commit()
+    if released:
+        await product_cache.invalidate(released)
+    await db.refresh(order, ["version"])
+    response.headers["ETag"] = await current_order_etag(db, id)
+    return order
+
+
+# Поток событий (Server-Sent Events) вместо опроса списков: создание и смена
+# статуса заказов, изменение остатка товаров. Фильтры: типы событий и id заказов
+# (для событий order) и товаров (для событий stock). Событие остатка содержит только
+# id товара, сам остаток читается через GET /products/{id} (кэш и ETag).
+# Клиент, не успевающий читать события, получает overflow и отключается.
+@router.get("/events")
+async def get_events(
+    types: Optional[List[Literal["order", "stock"]]] = Query(None),
+    order_id: Optional[List[int]] = Query(None),
+    product_id: Optional[List[int]] = Query(None),
+):
+    subscription = events.Subscription(types, order_id, product_id)
+    return StreamingResponse(
+        events.stream_events(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# 3. **Отчёты**: читаются из сводок, обновляемых вместе с заказами,
+# поэтому не просматривают историю заказов
+
+# Наибольший период отчёта о продажах в днях
+MAX_REPORT_DAYS = 366
+
+
+# Продажи по товарам и дням (по дате создания заказа, без отменённых заказов).
+# По умолчанию — последние 30 дней.
+@router.get("/reports/sales", response_model=List[schemas.SalesReportRow])
+async def get_sales_report(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    product_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    date_to = date_to or datetime.now(timezone.utc).date()
+    date_from = date_from or date_to - timedelta(days=30)
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must not be later than date_to")
+    if (date_to - date_from).days > MAX_REPORT_DAYS:
+        raise HTTPException(status_code=400, detail=f"Report period is too long (max {MAX_REPORT_DAYS} days)")
+    return await reports.sales_report(db, date_from, date_to, product_id)
+
+
+# Число заказов по статусам
+@router.get("/reports/order-status", response_model=List[schemas.StatusReportRow])
+async def get_order_status_report(db: AsyncSession = Depends(get_read_db)):
+    return await reports.status_report(db)
+
+
+# Товары с доступным остатком ниже порога дозаказа
+@router.get("/reports/low-stock", response_model=List[schemas.LowStockRow])
+async def get_low_stock_report(
+    threshold: int = Query(reports.REORDER_THRESHOLD, ge=1),
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    db: AsyncSession = Depends(get_read_db),
+):
+    return await reports.low_stock_report(db, threshold, limit)
+
+
+# Пересборка сводок по всей истории заказов (восстановление после ручных правок базы)
+@router.post("/reports/rebuild", dependencies=WRITE_ADMISSION)
+async def rebuild_reports(db: AsyncSession = Depends(get_db)):
+    await reports.rebuild_reports(db)
+    return {"detail": "Reports rebuilt"}
+
+
+# Сборка приложения. Импорт модуля и вызов фабрики не обращаются к базе:
+# движки создаются при первом запросе (database.get_engine). background_tasks=False —
+# без фоновых задач (тесты, отдельные процессы-обработчики). Схема базы данных
+# управляется миграциями Alembic (alembic upgrade head).
+def create_app(background_tasks: bool = True) -> FastAPI:
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        app.state.background_tasks = start_background_tasks() if background_tasks else []
+        try:
+            yield
+        finally:
+            for task in app.state.background_tasks:
+                task.cancel()
+            await dispose_engines()
+
+    app = FastAPI(lifespan=lifespan)
+    app.middleware("http")(record_request_metrics)
+    app.include_router(router)
+    return app
+
+
+# Приложение для uvicorn и gunicorn (src.main:app)
+app = create_app()
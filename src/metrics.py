@@ -0,0 +1,111 @@
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Порог медленного запроса в миллисекундах и заголовок Server-Timing в ответах
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "500"))
+METRICS_SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+
+logger = logging.getLogger("warehouse.sql")
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"]
+)
+REQUEST_QUERIES = Histogram(
+    "db_queries_per_request", "SQL statements executed per HTTP request", ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+REQUEST_DB_TIME = Histogram(
+    "db_time_per_request_seconds", "Total SQL execution time per HTTP request", ["route"]
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection"
+)
+SLOW_QUERIES = Counter("db_slow_queries_total", "SQL statements slower than DB_SLOW_QUERY_MS")
+ADMISSION_REJECTIONS = Counter(
+    "admission_rejected_total", "Write requests rejected by rate limits or the order write gate", ["reason"]
+)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+# Счётчики базы данных для текущего HTTP-запроса
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+
+
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+# Пул соединений, измеряющий ожидание свободного соединения при выдаче
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            POOL_CHECKOUT_WAIT.observe(waited)
+            stats = request_stats.get()
+            if stats is not None:
+                stats.pool_wait += waited
+
+
+# Подписка на события движка: число и время SQL-запросов, журнал медленных запросов
+def instrument_engine(sync_engine) -> None:
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        stats = request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+        if elapsed * 1000 >= DB_SLOW_QUERY_MS:
+            SLOW_QUERIES.inc()
+            logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, statement)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+        if started:
+            started.pop()
+
+
+def observe_request(method: str, route: str, status: int, elapsed: float, stats: RequestStats) -> None:
+    REQUEST_LATENCY.labels(method, route, str(status)).observe(elapsed)
+    REQUEST_QUERIES.labels(route).observe(stats.queries)
+    REQUEST_DB_TIME.labels(route).observe(stats.db_time)
+
+
+# Заголовок Server-Timing: время в базе, ожидание пула и остальное (код и сериализация)
+def server_timing(elapsed: float, stats: RequestStats) -> str:
+    app_time = max(elapsed - stats.db_time - stats.pool_wait, 0.0)
+    return (
+        f'db;desc="{stats.queries} queries";dur={stats.db_time * 1000:.2f}, '
+        f"pool;dur={stats.pool_wait * 1000:.2f}, "
+        f"app;dur={app_time * 1000:.2f}, "
+        f"total;dur={elapsed * 1000:.2f}"
+    )
+
+
+# При нескольких процессах (PROMETHEUS_MULTIPROC_DIR, см. gunicorn.conf.py)
+# метрики суммируются по файлам всех процессов
+def render_metrics() -> bytes:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
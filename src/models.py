@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import DDL, JSON, Column, Integer, String, Float, Date, DateTime, ForeignKey, Index, event
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 from sqlalchemy.orm import relationship
@@ -9,11 +9,56 @@ class Product(Base):
     __tablename__ = 'products'
     
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, index=True)
+    name = Column(String)
     description = Column(String, nullable=True)
     price = Column(Float)
     quantity = Column(Integer)
+    # Версия строки: увеличивается при каждом изменении, используется для ETag
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
+    __table_args__ = (
+        # Поиск по названию и его префиксу (LIKE 'abc%') независимо от правил сортировки базы
+        Index("ix_products_name_pattern", "name", postgresql_ops={"name": "varchar_pattern_ops"}),
+    )
+
+# Полнотекстовый поиск товаров по названию и описанию (совпадения в названии весят больше).
+# В PostgreSQL — вычисляемая колонка search_vector с GIN-индексом, в SQLite (замена в
+# бенчмарках) — внешняя таблица FTS5 с триггерами. Колонки нет в модели, потому что
+# её тип есть только в PostgreSQL; при create_all она добавляется здесь, в рабочей
+# базе — миграцией Alembic.
+SEARCH_CONFIG = "russian"
+
+PRODUCT_SEARCH_DDL = {
+    "postgresql": [
+        "ALTER TABLE products ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(name, '')), 'A') || "
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(description, '')), 'B')) STORED",
+        "CREATE INDEX ix_products_search_vector ON products USING gin (search_vector)",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE products_fts USING fts5(name, description, content='products', content_rowid='id')",
+        "CREATE TRIGGER products_fts_ai AFTER INSERT ON products BEGIN "
+        "INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+        "CREATE TRIGGER products_fts_ad AFTER DELETE ON products BEGIN "
+        "INSERT INTO products_fts(products_fts, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); END",
+        "CREATE TRIGGER products_fts_au AFTER UPDATE OF name, description ON products BEGIN "
+        "INSERT INTO products_fts(products_fts, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); "
+        "INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    ],
+}
+
+for dialect, statements in PRODUCT_SEARCH_DDL.items():
+    for statement in statements:
+        event.listen(Product.__table__, "after_create", DDL(statement).execute_if(dialect=dialect))
+event.listen(Product.__table__, "before_drop", DDL("DROP TABLE IF EXISTS products_fts").execute_if(dialect="sqlite"))
+
+# Заказы и их позиции. В рабочей базе PostgreSQL обе таблицы секционированы по
+# месяцам created_at (миграция Alembic 0009, новые секции создаёт archive.py), поэтому
+# первичные ключи там составные (id, created_at), а позиция хранит created_at своего
+# заказа. В модели секций нет: create_all (тесты, SQLite в бенчмарках) создаёт
+# обычные таблицы, а запросы к ним одинаковы.
 class Order(Base):
     __tablename__ = 'orders'
 
@@ -21,14 +66,155 @@ class Order(Base):
     id = Column(Integer, primary_key=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     status = Column(String)
+    # Причина отклонения заказа, обработанного через очередь
+    status_detail = Column(String, nullable=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # Сумма заказа по ценам на момент покупки и количество единиц товара в нём
+    total = Column(Float, nullable=False, default=0, server_default="0")
+    item_count = Column(Integer, nullable=False, default=0, server_default="0")
     items = relationship("OrderItem", back_populates="order")
 
+    __table_args__ = (
+        # Фильтры списка заказов по статусу и дате создания
+        Index("ix_orders_status_created_at", "status", "created_at"),
+        # Сортировка и фильтр списка заказов по сумме (keyset по total, id)
+        Index("ix_orders_total_id", "total", "id"),
+    )
+
 class OrderItem(Base):
     __tablename__ = 'order_items'
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     product_id = Column(Integer, ForeignKey('products.id'))
     order_id = Column(Integer, ForeignKey('orders.id'))
     quantity = Column(Integer)
+    # Время создания заказа: ключ секционирования позиций
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # Снимок товара на момент заказа: заказ показывает цену покупки, а не текущую,
+    # и читается без товаров
+    product_name = Column(String, nullable=True)
+    product_description = Column(String, nullable=True)
+    unit_price = Column(Float, nullable=True)
     order = relationship("Order", back_populates="items")
     Product = relationship("Product")
+
+    __table_args__ = (
+        # Позиции заказа (get_order, get_orders) и проверка внешнего ключа при удалении товара
+        Index("ix_order_items_order_id_product_id", "order_id", "product_id"),
+        Index("ix_order_items_product_id", "product_id"),
+    )
+
+# Архив доставленных заказов, перенесённых из рабочих таблиц (см. archive.py).
+# Колонки повторяют orders и order_items, id заказов и позиций сохраняются.
+class ArchivedOrder(Base):
+    __tablename__ = 'orders_archive'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    created_at = Column(DateTime)
+    status = Column(String)
+    status_detail = Column(String, nullable=True)
+    version = Column(Integer, nullable=False)
+    total = Column(Float, nullable=False)
+    item_count = Column(Integer, nullable=False)
+    archived_at = Column(DateTime, nullable=False)
+    items = relationship("ArchivedOrderItem")
+
+    __table_args__ = (
+        Index("ix_orders_archive_created_at", "created_at"),
+    )
+
+class ArchivedOrderItem(Base):
+    __tablename__ = 'order_items_archive'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    product_id = Column(Integer, ForeignKey('products.id'))
+    order_id = Column(Integer, ForeignKey('orders_archive.id'))
+    quantity = Column(Integer)
+    created_at = Column(DateTime, nullable=False)
+    product_name = Column(String, nullable=True)
+    product_description = Column(String, nullable=True)
+    unit_price = Column(Float, nullable=True)
+    Product = relationship("Product")
+
+    __table_args__ = (
+        Index("ix_order_items_archive_order_id", "order_id"),
+        Index("ix_order_items_archive_product_id", "product_id"),
+    )
+
+# Доступный остаток товара, разделённый на несколько строк-шардов: параллельные
+# заказы списывают товар из разных шардов и не ждут друг друга на одной строке
+class StockShard(Base):
+    __tablename__ = 'stock_shards'
+
+    product_id = Column(Integer, ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    quantity = Column(Integer, nullable=False)
+
+# Журнал движения товара (только добавление): резерв под заказ (отрицательное
+# количество), возврат при отмене (положительное) и подтверждение при доставке
+class StockMovement(Base):
+    __tablename__ = 'stock_movements'
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
+    # Без внешнего ключа: на секционированную таблицу заказов можно сослаться только
+    # по (id, created_at), а движения архивируемых заказов удаляются вместе с ними
+    order_id = Column(Integer, nullable=True)
+    quantity = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_stock_movements_order_id", "order_id"),
+        Index("ix_stock_movements_product_id", "product_id"),
+    )
+
+# Сводки для отчётов, обновляемые в транзакциях заказов (см. reports.py): продажи
+# товара по дням создания заказов и число заказов по статусам. Строки разделены на
+# шарды по id заказа, чтобы параллельные заказы не ждали друг друга на одной строке.
+class SalesDaily(Base):
+    __tablename__ = 'sales_daily'
+
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    units = Column(Integer, nullable=False)
+    orders = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        # Отчёт о продажах одного товара за период
+        Index("ix_sales_daily_product_id_day", "product_id", "day"),
+    )
+
+class OrderStatusCount(Base):
+    __tablename__ = 'order_status_counts'
+
+    status = Column(String, primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+# Ключи идемпотентности POST-запросов вместе с сохранённым ответом (см. idempotency.py)
+class IdempotencyKey(Base):
+    __tablename__ = 'idempotency_keys'
+
+    key = Column(String, primary_key=True)
+    # Хэш метода, пути и тела запроса: ключ нельзя повторно использовать для другого запроса
+    fingerprint = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=True)
+    response = Column(JSON, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # Удаление просроченных ключей
+        Index("ix_idempotency_keys_created_at", "created_at"),
+    )
+
+# Очередь заказов, принятых без обработки (POST /orders/ с Prefer: respond-async).
+# Обработчики забирают задания через SELECT ... FOR UPDATE SKIP LOCKED (см. order_queue.py)
+class OrderJob(Base):
+    __tablename__ = 'order_jobs'
+
+    id = Column(Integer, primary_key=True)
+    # Без внешнего ключа, как в stock_movements: заказ в очереди не архивируется
+    order_id = Column(Integer, nullable=False, unique=True)
+    created_at = Column(DateTime, nullable=False)
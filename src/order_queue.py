@@ -0,0 +1,115 @@
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import events, reports, stock
+from .cache import product_cache
+from .models import Order, OrderItem, OrderJob, Product
+
+# Размер пачки заданий, забираемой обработчиком за одну транзакцию, и период
+# опроса пустой очереди в секундах
+ORDER_QUEUE_BATCH_SIZE = int(os.getenv("ORDER_QUEUE_BATCH_SIZE", "100"))
+ORDER_QUEUE_POLL_INTERVAL = float(os.getenv("ORDER_QUEUE_POLL_INTERVAL", "1"))
+# Обработчик очереди внутри процесса приложения; при отдельных процессах
+# обработчиков (python -m src.worker) его можно выключить
+ORDER_QUEUE_IN_APP_WORKER = os.getenv("ORDER_QUEUE_IN_APP_WORKER", "true").lower() in ("1", "true", "yes")
+
+orders = Order.__table__
+
+
+# Постановка вставленных заказов (со статусом «в очереди») в очередь обработки
+async def enqueue_orders(db: AsyncSession, order_ids: List[int], created_at: datetime) -> None:
+    await db.execute(insert(OrderJob), [{"order_id": order_id, "created_at": created_at} for order_id in order_ids])
+    await reports.record_status_counts(db, [(order_id, reports.QUEUED_ORDER_STATUS, 1) for order_id in order_ids])
+
+
+# Обработка одной пачки заданий в одной транзакции: задания забираются через
+# FOR UPDATE SKIP LOCKED (параллельные обработчики берут разные задания), шарды
+# остатка всех товаров пачки блокируются один раз, как в POST /orders/batch.
+# Принятые заказы переходят в статус «в процессе», заказы, которым не хватило
+# товара, — в «отклонён» с причиной. Если обработчик упадёт, транзакция
+# откатится и задания останутся в очереди.
+# Возвращает количество обработанных заданий.
+async def process_order_jobs(db: AsyncSession, batch_size: int = ORDER_QUEUE_BATCH_SIZE) -> int:
+    jobs = (await db.execute(
+        select(OrderJob.id, OrderJob.order_id)
+        .order_by(OrderJob.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )).all()
+    if not jobs:
+        await db.rollback()
+        return 0
+    order_ids = [job.order_id for job in jobs]
+
+    created_at = dict((await db.execute(select(Order.id, Order.created_at).where(Order.id.in_(order_ids)))).all())
+    requested_per_order: Dict[int, Dict[int, int]] = {order_id: defaultdict(int) for order_id in order_ids}
+    items = await db.execute(
+        select(OrderItem.order_id, OrderItem.product_id, OrderItem.quantity).where(OrderItem.order_id.in_(order_ids))
+    )
+    for order_id, product_id, quantity in items:
+        requested_per_order[order_id][product_id] += quantity
+    product_ids = set().union(*requested_per_order.values())
+    names = dict((await db.execute(select(Product.id, Product.name).where(Product.id.in_(product_ids)))).all())
+
+    available = await stock.lock_stock(db, product_ids)
+    accepted = []
+    rejected = {}
+    for order_id in order_ids:
+        requested = requested_per_order[order_id]
+        shortage = next((product_id for product_id, quantity in requested.items()
+                         if available.get(product_id, 0) < quantity), None)
+        if shortage is not None:
+            rejected[order_id] = f"Insufficient stock for product {names[shortage]}"
+            continue
+        for product_id, quantity in requested.items():
+            available[product_id] -= quantity
+        accepted.append(order_id)
+
+    statuses = {
+        order_id: reports.REJECTED_ORDER_STATUS if order_id in rejected else reports.NEW_ORDER_STATUS
+        for order_id in order_ids
+    }
+    accepted_requested = [requested_per_order[order_id] for order_id in accepted]
+    reserved_ids = set().union(*accepted_requested)
+    await stock.write_stock(db, {product_id: available[product_id] for product_id in reserved_ids})
+    await stock.record_reservations(db, accepted, accepted_requested)
+    await db.execute(
+        update(orders)
+        .where(orders.c.id == bindparam("b_id"))
+        .values(status=bindparam("b_status"), status_detail=bindparam("b_detail"), version=orders.c.version + 1),
+        [
+            {"b_id": order_id, "b_status": status, "b_detail": rejected.get(order_id)}
+            for order_id, status in statuses.items()
+        ],
+    )
+    await reports.record_sales(db, accepted, [created_at[order_id] for order_id in accepted], accepted_requested)
+    await reports.record_status_counts(db, [
+        change
+        for order_id, status in statuses.items()
+        for change in ((order_id, reports.QUEUED_ORDER_STATUS, -1), (order_id, status, 1))
+    ])
+    await events.broker.publish(db, [
+        *(events.order_event(order_id, status) for order_id, status in statuses.items()),
+        *events.stock_events(reserved_ids),
+    ])
+    await db.execute(delete(OrderJob).where(OrderJob.id.in_([job.id for job in jobs])))
+    await db.commit()
+    # В отдельном процессе обработчика сброс доходит до процессов приложения
+    # только через общий бэкенд кэша (redis); кэш в памяти устареет не дольше CACHE_TTL
+    await product_cache.invalidate(reserved_ids)
+    return len(jobs)
+
+
+# Обработка пачек, пока очередь не опустеет; возвращает количество обработанных заданий
+async def drain_order_queue(db: AsyncSession) -> int:
+    processed = 0
+    while True:
+        batch = await process_order_jobs(db)
+        if not batch:
+            return processed
+        processed += batch
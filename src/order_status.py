@@ -0,0 +1,92 @@
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import events, reports, stock
+from .models import Order
+
+# Допустимые переходы статусов заказа: статус -> в какие статусы его можно
+# перевести. Заказ в очереди получает статус от обработчика очереди, закрытые
+# заказы (доставлен, отменён, отклонён) статус больше не меняют.
+ORDER_STATUS_TRANSITIONS: Dict[str, Tuple[str, ...]] = {
+    reports.NEW_ORDER_STATUS: (
+        reports.SHIPPED_ORDER_STATUS, reports.DELIVERED_ORDER_STATUS, reports.CANCELLED_ORDER_STATUS,
+    ),
+    reports.SHIPPED_ORDER_STATUS: (reports.DELIVERED_ORDER_STATUS, reports.CANCELLED_ORDER_STATUS),
+    reports.DELIVERED_ORDER_STATUS: (),
+    reports.CANCELLED_ORDER_STATUS: (),
+    reports.QUEUED_ORDER_STATUS: (),
+    reports.REJECTED_ORDER_STATUS: (),
+}
+# Статусы, которые можно задать через API
+SETTABLE_ORDER_STATUSES = (
+    reports.NEW_ORDER_STATUS, reports.SHIPPED_ORDER_STATUS, reports.DELIVERED_ORDER_STATUS, reports.CANCELLED_ORDER_STATUS,
+)
+
+orders = Order.__table__
+
+
+# Статусы, из которых заказ можно перевести в status
+def allowed_predecessors(status: str) -> List[str]:
+    return [previous for previous, targets in ORDER_STATUS_TRANSITIONS.items() if status in targets]
+
+
+# Причина, по которой заказ со статусом current нельзя перевести в status, или None
+def transition_error(current: str, status: str) -> Optional[str]:
+    if status in ORDER_STATUS_TRANSITIONS.get(current, ()):
+        return None
+    if current == reports.QUEUED_ORDER_STATUS:
+        return "Order is still being processed"
+    if current in stock.CLOSED_ORDER_STATUSES:
+        return f"Cannot change status of a closed order: {current}"
+    return f"Cannot change status from {current} to {status}"
+
+
+# Перевод заказов, отобранных условиями conditions, в статус status одним UPDATE
+# на каждый допустимый прежний статус (RETURNING не возвращает старое значение
+# статуса, а оно нужно сводкам). Строки блокируются в порядке id, поэтому
+# параллельные массовые обновления не взаимоблокируются; заказ, статус которого
+# успели изменить, условию статуса уже не подходит и не обновляется.
+# Возвращает список (id заказа, время создания, прежний статус) в порядке id.
+async def transition_orders(db: AsyncSession, status: str, conditions: list, limit: Optional[int] = None) -> List[tuple]:
+    changed = []
+    for previous in allowed_predecessors(status):
+        if limit is not None and len(changed) >= limit:
+            break
+        candidates = (
+            select(orders.c.id)
+            .where(*conditions, orders.c.status == previous)
+            .order_by(orders.c.id)
+            .with_for_update()
+        )
+        if limit is not None:
+            candidates = candidates.limit(limit - len(changed))
+        result = await db.execute(
+            update(orders)
+            .where(orders.c.id.in_(candidates), orders.c.status == previous)
+            .values(status=status, version=orders.c.version + 1)
+            .returning(orders.c.id, orders.c.created_at)
+        )
+        changed.extend((order_id, created_at, previous) for order_id, created_at in result)
+    return sorted(changed)
+
+
+# Последствия смены статуса заказов changed (см. transition_orders): отмена
+# возвращает резерв на склад, доставка подтверждает его как продажу, сводки и
+# события. Возвращает id товаров, остаток которых изменился.
+async def apply_status_change(db: AsyncSession, changed: List[tuple], status: str) -> List[int]:
+    if not changed:
+        return []
+    order_ids = [order_id for order_id, _, _ in changed]
+    released = []
+    if status == reports.CANCELLED_ORDER_STATUS:
+        released = await stock.release_order_stock(db, order_ids)
+    elif status == reports.DELIVERED_ORDER_STATUS:
+        await stock.confirm_order_stock(db, order_ids)
+    await reports.record_status_changes(db, changed, status)
+    await events.broker.publish(db, [
+        *(events.order_event(order_id, status) for order_id in order_ids),
+        *events.stock_events(released),
+    ])
+    return released
@@ -0,0 +1,184 @@
+import os
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import delete, func, insert, select, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem, OrderStatusCount, Product, SalesDaily
+from .stock import available_quantity
+
+# Количество шардов строк сводок и порог остатка для отчёта о дозаказе по умолчанию
+REPORT_SHARDS = int(os.getenv("REPORT_SHARDS", "8"))
+REORDER_THRESHOLD = int(os.getenv("REORDER_THRESHOLD", "10"))
+
+# Статус нового заказа, статусы заказа в очереди и отклонённого при её обработке
+NEW_ORDER_STATUS = "в процессе"
+QUEUED_ORDER_STATUS = "в очереди"
+REJECTED_ORDER_STATUS = "отклонён"
+CANCELLED_ORDER_STATUS = "отменён"
+SHIPPED_ORDER_STATUS = "отправлен"
+DELIVERED_ORDER_STATUS = "доставлен"
+# Статусы, при которых заказ не считается продажей
+NOT_SOLD_ORDER_STATUSES = (QUEUED_ORDER_STATUS, REJECTED_ORDER_STATUS, CANCELLED_ORDER_STATUS)
+
+sales = SalesDaily.__table__
+status_counts = OrderStatusCount.__table__
+
+
+def order_shard(order_id: int) -> int:
+    return order_id % REPORT_SHARDS
+
+
+# INSERT ... ON CONFLICT DO UPDATE, прибавляющий значения колонок к строке сводки.
+# Строки вставляются в порядке первичного ключа, поэтому транзакции, меняющие
+# несколько строк сводки, не взаимоблокируются.
+async def add_to_summary(db: AsyncSession, table, rows: List[dict], columns: Iterable[str]) -> None:
+    if not rows:
+        return
+    dialect = sqlite if db.get_bind().dialect.name == "sqlite" else postgresql
+    statement = dialect.insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(table.primary_key.columns),
+        set_={column: table.c[column] + statement.excluded[column] for column in columns},
+    )
+    key = [column.name for column in table.primary_key.columns]
+    await db.execute(statement, sorted(rows, key=lambda row: [row[column] for column in key]))
+
+
+# Продажи заказов (sign=-1 — их отмена): количество товара и число заказов
+# по дню создания заказа. requested_per_order — словари id товара -> количество.
+async def record_sales(
+    db: AsyncSession, order_ids: List[int], created_at: List[datetime], requested_per_order: List[dict], sign: int = 1
+) -> None:
+    totals = defaultdict(lambda: [0, 0])
+    for order_id, order_created_at, requested in zip(order_ids, created_at, requested_per_order):
+        for product_id, quantity in requested.items():
+            total = totals[(order_created_at.date(), product_id, order_shard(order_id))]
+            total[0] += sign * quantity
+            total[1] += sign
+    await add_to_summary(db, sales, [
+        {"day": day, "product_id": product_id, "shard": shard, "units": units, "orders": orders}
+        for (day, product_id, shard), (units, orders) in totals.items()
+    ], ("units", "orders"))
+
+
+# Изменение числа заказов по статусам: список (id заказа, статус, +1 или -1)
+async def record_status_counts(db: AsyncSession, changes: List[tuple]) -> None:
+    counts: Dict[tuple, int] = defaultdict(int)
+    for order_id, status, delta in changes:
+        counts[(status, order_shard(order_id))] += delta
+    await add_to_summary(db, status_counts, [
+        {"status": status, "shard": shard, "count": count} for (status, shard), count in counts.items()
+    ], ("count",))
+
+
+# Новые заказы в сводках. Вызывается последним шагом транзакции заказа,
+# чтобы строки сводок оставались заблокированными только до её фиксации.
+async def record_new_orders(
+    db: AsyncSession, order_ids: List[int], created_at: datetime, requested_per_order: List[dict]
+) -> None:
+    await record_sales(db, order_ids, [created_at] * len(order_ids), requested_per_order)
+    await record_status_counts(db, [(order_id, NEW_ORDER_STATUS, 1) for order_id in order_ids])
+
+
+# Смена статуса заказов в сводках; отменённые заказы вычитаются из продаж.
+# changes — список (id заказа, время создания, прежний статус).
+async def record_status_changes(db: AsyncSession, changes: List[tuple], status: str) -> None:
+    if not changes:
+        return
+    if status == CANCELLED_ORDER_STATUS:
+        order_ids = [order_id for order_id, _, _ in changes]
+        result = await db.execute(
+            select(OrderItem.order_id, OrderItem.product_id, func.sum(OrderItem.quantity))
+            .where(OrderItem.order_id.in_(order_ids))
+            .group_by(OrderItem.order_id, OrderItem.product_id)
+        )
+        requested: Dict[int, Dict[int, int]] = defaultdict(dict)
+        for order_id, product_id, quantity in result:
+            requested[order_id][product_id] = quantity
+        await record_sales(
+            db, order_ids, [created_at for _, created_at, _ in changes],
+            [requested[order_id] for order_id in order_ids], sign=-1,
+        )
+    await record_status_counts(db, [
+        change for order_id, _, previous in changes for change in ((order_id, previous, -1), (order_id, status, 1))
+    ])
+
+
+# Продажи по товарам и дням за период [date_from, date_to]
+async def sales_report(db: AsyncSession, date_from: date, date_to: date, product_id: Optional[int] = None) -> List[dict]:
+    conditions = [SalesDaily.day >= date_from, SalesDaily.day <= date_to]
+    if product_id is not None:
+        conditions.append(SalesDaily.product_id == product_id)
+    result = await db.execute(
+        select(
+            SalesDaily.day, SalesDaily.product_id, Product.name,
+            func.sum(SalesDaily.units).label("units"), func.sum(SalesDaily.orders).label("orders"),
+        )
+        .join(Product, Product.id == SalesDaily.product_id)
+        .where(*conditions)
+        .group_by(SalesDaily.day, SalesDaily.product_id, Product.name)
+        .having(func.sum(SalesDaily.orders) > 0)
+        .order_by(SalesDaily.day, SalesDaily.product_id)
+    )
+    return [row._asdict() for row in result]
+
+
+# Число заказов по статусам
+async def status_report(db: AsyncSession) -> List[dict]:
+    result = await db.execute(
+        select(OrderStatusCount.status, func.sum(OrderStatusCount.count).label("count"))
+        .group_by(OrderStatusCount.status)
+        .having(func.sum(OrderStatusCount.count) > 0)
+        .order_by(OrderStatusCount.status)
+    )
+    return [row._asdict() for row in result]
+
+
+# Товары, доступный остаток которых ниже порога, начиная с самых дефицитных
+async def low_stock_report(db: AsyncSession, threshold: int, limit: int) -> List[dict]:
+    quantity = available_quantity().label("quantity")
+    result = await db.execute(
+        select(Product.id, Product.name, quantity)
+        .where(quantity < threshold)
+        .order_by(quantity, Product.id)
+        .limit(limit)
+    )
+    return [row._asdict() for row in result]
+
+
+# Пересборка сводок по всей истории заказов (GROUP BY по позициям и заказам,
+# включая архив). Нужна только для восстановления сводок; обычно они обновляются
+# вместе с заказами. Заказы без статуса или времени создания (строки до появления
+# значений по умолчанию) в сводки не попадают, как и при начальном заполнении.
+async def rebuild_reports(db: AsyncSession) -> None:
+    orders = union_all(
+        select(Order.id, Order.created_at, Order.status),
+        select(ArchivedOrder.id, ArchivedOrder.created_at, ArchivedOrder.status),
+    ).subquery()
+    items = union_all(
+        select(OrderItem.order_id, OrderItem.product_id, OrderItem.quantity),
+        select(ArchivedOrderItem.order_id, ArchivedOrderItem.product_id, ArchivedOrderItem.quantity),
+    ).subquery()
+    recorded = (orders.c.status.is_not(None), orders.c.created_at.is_not(None))
+    shard = (orders.c.id % REPORT_SHARDS).label("shard")
+    day = func.date(orders.c.created_at).label("day")
+    await db.execute(delete(SalesDaily))
+    await db.execute(delete(OrderStatusCount))
+    await db.execute(insert(SalesDaily).from_select(
+        ["day", "product_id", "shard", "units", "orders"],
+        select(day, items.c.product_id, shard, func.sum(items.c.quantity), func.count(func.distinct(orders.c.id)))
+        .join(orders, orders.c.id == items.c.order_id)
+        .where(*recorded, orders.c.status.not_in(NOT_SOLD_ORDER_STATUSES))
+        .group_by(day, items.c.product_id, shard),
+    ))
+    await db.execute(insert(OrderStatusCount).from_select(
+        ["status", "shard", "count"],
+        select(orders.c.status, shard, func.count())
+        .where(*recorded)
+        .group_by(orders.c.status, shard),
+    ))
+    await db.commit()
@@ -1,6 +1,15 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator, model_validator
 from typing import List, Optional
-from datetime import datetime
+from datetime import date, datetime, timezone
+
+
+# Время заказов хранится без часового пояса (UTC): время с поясом из запроса
+# переводится в UTC, иначе PostgreSQL не сравнит его с колонкой timestamp
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
 
 # Pydantic модели для продуктов
 class ProductBase(BaseModel):
@@ -12,11 +21,17 @@ class ProductBase(BaseModel):
 class ProductCreate(ProductBase):
     pass
 
+# Строка массового импорта: при наличии id товар обновляется
+class ProductImport(ProductBase):
+    id: Optional[int] = None
+
 class Product(ProductBase):
     id: int
+    version: int
 
     class Config:
-        orm_mode = True  
+        orm_mode = True
+        from_attributes = True
 
 class ProductResponse(BaseModel):
     id: int
@@ -24,9 +39,26 @@ class ProductResponse(BaseModel):
     description: Optional[str] = None
     price: float
     quantity: int
+    version: int
 
     class Config:
         orm_mode = True
+        from_attributes = True
+
+# Страница списка продуктов с курсором на следующую страницу
+class ProductPage(BaseModel):
+    items: List[ProductResponse]
+    next_cursor: Optional[str] = None
+
+# Результат массового импорта товаров с ошибками по строкам
+class BulkRowError(BaseModel):
+    line: int
+    error: str
+
+class BulkImportResult(BaseModel):
+    processed: int
+    upserted: int
+    errors: List[BulkRowError]
 
 # Pydantic модели для элементов заказа
 class OrderItem(BaseModel):
@@ -35,7 +67,7 @@ class OrderItem(BaseModel):
 
 class OrderItemCreate(BaseModel):
     product_id: int
-    quantity: int
+    quantity: int = Field(..., gt=0)
 
 
 class OrderItem(OrderItem):
@@ -44,13 +76,14 @@ class OrderItem(OrderItem):
 
     class Config:
         orm_mode = True
+        from_attributes = True
 
 # Pydantic модели для заказов
 class OrderBase(BaseModel):
     status: str
 
 class OrderCreate(BaseModel):
-    items: List[OrderItemCreate]
+    items: List[OrderItemCreate] = Field(..., min_length=1)
 
 class Order(OrderBase):
     id: int
@@ -59,24 +92,105 @@ class Order(OrderBase):
 
     class Config:
         orm_mode = True
-
-# Модель для обновления статуса заказа
+        from_attributes = True
+
+# Отбор заказов для массовой смены статуса: текущий статус и период создания
+# [created_from, created_to). Пустой отбор выбрал бы все заказы, поэтому нужен
+# хотя бы один критерий.
+class OrderStatusFilter(BaseModel):
+    status: Optional[str] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+
+    @field_validator("created_from", "created_to")
+    @classmethod
+    def to_naive_utc(cls, value):
+        return naive_utc(value)
+
+    @model_validator(mode="after")
+    def require_criteria(self):
+        if self.status is None and self.created_from is None and self.created_to is None:
+            raise ValueError("Filter needs at least one of status, created_from, created_to")
+        return self
+
+# Массовая смена статуса: новый статус и либо список id заказов, либо отбор
 class OrderStatusUpdate(BaseModel):
     status: str
+    ids: Optional[List[int]] = None
+    filter: Optional[OrderStatusFilter] = None
+
+# Заказ, статус которого не изменён, с текущим статусом и причиной
+class OrderStatusRejection(BaseModel):
+    id: int
+    status: Optional[str] = None
+    detail: str
+
+# Результат массовой смены статуса: unchanged — заказы, у которых уже был этот
+# статус (как повторная установка в PATCH /orders/{id}/status, не ошибка);
+# has_more — по отбору обновлены не все заказы
+class OrderStatusUpdateResult(BaseModel):
+    status: str
+    updated: List[int]
+    unchanged: List[int] = []
+    rejected: List[OrderStatusRejection]
+    has_more: bool = False
 
 class OrderItemResponse(BaseModel):
     id: int
     product_id: int
     quantity: int
+    # Название и цена товара на момент заказа
+    product_name: Optional[str] = None
+    unit_price: Optional[float] = None
 
     class Config:
-        orm_mode = True 
+        orm_mode = True
+        from_attributes = True
 
 class OrderResponse(BaseModel):
     id: int
     created_at: datetime
     status: str
+    status_detail: Optional[str] = None
+    version: int
+    total: float
+    item_count: int
     items: List[OrderItemResponse]
 
     class Config:
         orm_mode = True
+        from_attributes = True
+
+# Страница списка заказов с курсором на следующую страницу
+class OrderPage(BaseModel):
+    items: List[OrderResponse]
+    next_cursor: Optional[str] = None
+
+# Заказ, принятый в очередь на обработку
+class OrderAccepted(BaseModel):
+    id: int
+    status: str
+
+# Результат создания одного заказа из пачки: заказ или ошибка
+class OrderBatchResult(BaseModel):
+    index: int
+    status_code: int
+    order: Optional[OrderResponse] = None
+    detail: Optional[str] = None
+
+# Строки отчётов: продажи товара за день, заказы по статусу и товары на дозаказ
+class SalesReportRow(BaseModel):
+    day: date
+    product_id: int
+    name: str
+    units: int
+    orders: int
+
+class StatusReportRow(BaseModel):
+    status: str
+    count: int
+
+class LowStockRow(BaseModel):
+    id: int
+    name: str
+    quantity: int
@@ -0,0 +1,40 @@
+from sqlalchemy import column, func, literal_column, select, table
+
+from .models import SEARCH_CONFIG, Product
+
+search_vector = literal_column("products.search_vector")
+products_fts = table("products_fts", column("rowid"))
+
+
+# Запрос пользователя для FTS5: каждое слово берётся в кавычки, чтобы символы
+# синтаксиса MATCH (двоеточия, звёздочки, скобки) не вызывали ошибок
+def fts5_query(q: str) -> str:
+    return " ".join('"' + word.replace('"', '""') + '"' for word in q.split())
+
+
+# Запрос страницы поиска товаров по релевантности (чем больше rank, тем выше в выдаче).
+# Ранжируются только id совпавших товаров, а колонки ответа (с остатком по шардам)
+# вычисляются уже для строк страницы. В PostgreSQL используется websearch_to_tsquery:
+# он понимает кавычки, OR и минус и не падает на произвольном вводе; в SQLite —
+# FTS5 с ранжированием bm25.
+def search_query(dialect: str, q: str, columns, offset: int = 0, limit: int = 100):
+    if dialect == "sqlite":
+        # Веса колонок bm25 (name, description): совпадение в названии важнее
+        rank = -func.bm25(literal_column("products_fts"), 2.0, 1.0)
+        ranked = (
+            select(products_fts.c.rowid.label("id"), rank.label("rank"))
+            .where(literal_column("products_fts").op("MATCH")(fts5_query(q)))
+        )
+    else:
+        tsquery = func.websearch_to_tsquery(literal_column(f"'{SEARCH_CONFIG}'::regconfig"), q)
+        # Ранжируются все совпадения: обрезка до ранжирования отбрасывала бы
+        # самые релевантные товары, если индекс вернул их не первыми
+        rank = func.ts_rank_cd(search_vector, tsquery)
+        ranked = select(Product.id, rank.label("rank")).where(search_vector.op("@@")(tsquery))
+
+    page = ranked.order_by(rank.desc(), literal_column("id")).offset(offset).limit(limit).subquery()
+    return (
+        select(*columns)
+        .join(page, page.c.id == Product.id)
+        .order_by(page.c.rank.desc(), Product.id)
+    )
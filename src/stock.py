@@ -0,0 +1,274 @@
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Order, Product, StockMovement, StockShard
+
+# Количество шардов остатка на товар, период уплотнения и срок хранения журнала
+STOCK_SHARDS = int(os.getenv("STOCK_SHARDS", "8"))
+STOCK_COMPACTION_INTERVAL = float(os.getenv("STOCK_COMPACTION_INTERVAL", "60"))
+STOCK_LEDGER_RETENTION_DAYS = int(os.getenv("STOCK_LEDGER_RETENTION_DAYS", "30"))
+# Сколько товаров уплотняется в одной транзакции
+STOCK_COMPACTION_BATCH_SIZE = int(os.getenv("STOCK_COMPACTION_BATCH_SIZE", "100"))
+
+# Статусы, после которых резерв заказа больше не меняется
+# (отклонённый при обработке очереди заказ ничего не резервировал)
+CLOSED_ORDER_STATUSES = ("доставлен", "отменён", "отклонён")
+
+shards = StockShard.__table__
+products = Product.__table__
+
+
+# Доступный остаток: сумма шардов товара, а для товара без шардов (ещё не
+# заказывался или остаток задан заново) — снимок в products.quantity.
+# Шардов не больше STOCK_SHARDS, поэтому чтение остаётся O(1) на товар.
+def available_quantity():
+    shard_total = (
+        select(func.sum(StockShard.quantity))
+        .where(StockShard.product_id == Product.id)
+        .scalar_subquery()
+    )
+    return func.coalesce(shard_total, Product.quantity)
+
+
+# Разбиение остатка поровну между шардами
+def split_stock(total: int) -> List[int]:
+    base, extra = divmod(max(total or 0, 0), STOCK_SHARDS)
+    return [base + (1 if shard < extra else 0) for shard in range(STOCK_SHARDS)]
+
+
+def insert_ignoring_conflicts(db: AsyncSession, table):
+    dialect = sqlite if db.get_bind().dialect.name == "sqlite" else postgresql
+    return dialect.insert(table).on_conflict_do_nothing()
+
+
+# Быстрый путь резервирования: списание из одного случайного шарда, в котором
+# хватает товара. С skip_locked занятые другими транзакциями шарды пропускаются,
+# без него шард выбирается без блокировки и UPDATE ждёт только этот шард,
+# а не все шарды товара.
+async def reserve_from_shard(db: AsyncSession, product_id: int, quantity: int, skip_locked: bool = True) -> bool:
+    candidate = (
+        select(shards.c.shard)
+        .where(shards.c.product_id == product_id, shards.c.quantity >= quantity)
+        .order_by(func.random())
+        .limit(1)
+    )
+    if skip_locked:
+        candidate = candidate.with_for_update(skip_locked=True)
+    result = await db.execute(
+        update(shards)
+        .where(shards.c.product_id == product_id, shards.c.shard == candidate.scalar_subquery(), shards.c.quantity >= quantity)
+        .values(quantity=shards.c.quantity - quantity)
+        .returning(shards.c.shard)
+    )
+    return result.first() is not None
+
+
+async def _locked_totals(db: AsyncSession, product_ids: List[int]) -> Dict[int, int]:
+    result = await db.execute(
+        select(shards.c.product_id, shards.c.quantity)
+        .where(shards.c.product_id.in_(product_ids))
+        .order_by(shards.c.product_id, shards.c.shard)
+        .with_for_update()
+    )
+    totals: Dict[int, int] = {}
+    for product_id, quantity in result:
+        totals[product_id] = totals.get(product_id, 0) + quantity
+    return totals
+
+
+# Медленный путь: блокировка всех шардов товаров в порядке (товар, шард) и
+# подсчёт полного остатка. Все транзакции берут блокировки шардов в этом порядке,
+# поэтому взаимоблокировок нет. Товары без шардов получают их из снимка остатка.
+# Возвращает словарь id товара -> остаток (несуществующих товаров в нём нет).
+async def lock_stock(db: AsyncSession, product_ids: Iterable[int]) -> Dict[int, int]:
+    ids = sorted(set(product_ids))
+    if not ids:
+        return {}
+    totals = await _locked_totals(db, ids)
+
+    missing = [product_id for product_id in ids if product_id not in totals]
+    if missing:
+        snapshots = await db.execute(select(Product.id, Product.quantity).where(Product.id.in_(missing)))
+        rows = [
+            {"product_id": product_id, "shard": shard, "quantity": quantity}
+            for product_id, total in snapshots
+            for shard, quantity in enumerate(split_stock(total))
+        ]
+        if rows:
+            await db.execute(insert_ignoring_conflicts(db, shards), rows)
+            totals.update(await _locked_totals(db, missing))
+    return totals
+
+
+# Запись новых остатков заблокированных товаров: остаток заново делится поровну
+# между шардами, а снимок в products.quantity обновляется. Шарды должны быть
+# заблокированы через lock_stock в этой же транзакции.
+async def write_stock(db: AsyncSession, totals: Dict[int, int]) -> None:
+    if not totals:
+        return
+    await db.execute(
+        update(shards)
+        .where(shards.c.product_id == bindparam("b_product_id"), shards.c.shard == bindparam("b_shard"))
+        .values(quantity=bindparam("b_quantity")),
+        [
+            {"b_product_id": product_id, "b_shard": shard, "b_quantity": quantity}
+            for product_id, total in totals.items()
+            for shard, quantity in enumerate(split_stock(total))
+        ],
+    )
+    await db.execute(
+        update(products)
+        .where(products.c.id == bindparam("b_product_id"))
+        .values(quantity=bindparam("b_quantity")),
+        [{"b_product_id": product_id, "b_quantity": total} for product_id, total in totals.items()],
+    )
+
+
+# Сброс шардов перед тем, как остаток товара задаётся заново (PUT, импорт):
+# доступным остатком снова становится products.quantity.
+# Возвращает остатки по шардам до сброса (только для товаров, у которых они были).
+async def reset_stock(db: AsyncSession, product_ids: Iterable[int]) -> Dict[int, int]:
+    ids = sorted(set(product_ids))
+    if not ids:
+        return {}
+    totals = await _locked_totals(db, ids)
+    if totals:
+        await db.execute(delete(shards).where(shards.c.product_id.in_(list(totals))))
+    return totals
+
+
+# Запись движений товара в журнал одним запросом:
+# movements — id заказа -> {id товара: количество}
+async def record_movements(db: AsyncSession, movements: Dict[int, Dict[int, int]], kind: str) -> None:
+    created_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    rows = [
+        {"product_id": product_id, "order_id": order_id, "quantity": quantity, "kind": kind, "created_at": created_at}
+        for order_id, quantities in movements.items()
+        for product_id, quantity in quantities.items()
+    ]
+    if rows:
+        await db.execute(insert(StockMovement), rows)
+
+
+# Резервирование товара под один заказ: сначала свободный шард, затем ожидание
+# одного шарда и только если ни в одном шарде не хватает — все шарды под блокировкой.
+# Товары обходятся в порядке id, поэтому заказы не взаимоблокируются.
+# Неудачная попытка быстрого пути может оставить за собой блокировку шарда
+# (строка изменилась, пока транзакция её ждала), поэтому обе попытки идут под
+# точкой сохранения: откат к ней снимает такие блокировки до медленного пути,
+# который берёт шарды строго по порядку.
+# Возвращает id первого товара, которому не хватило остатка, или None.
+async def reserve_order_stock(db: AsyncSession, requested: Dict[int, int]) -> Optional[int]:
+    for product_id in sorted(requested):
+        quantity = requested[product_id]
+        savepoint = await db.begin_nested()
+        if (await reserve_from_shard(db, product_id, quantity)
+                or await reserve_from_shard(db, product_id, quantity, skip_locked=False)):
+            await savepoint.commit()
+            continue
+        await savepoint.rollback()
+        available = await lock_stock(db, [product_id])
+        if available.get(product_id, 0) < quantity:
+            return product_id
+        await write_stock(db, {product_id: available[product_id] - quantity})
+    return None
+
+
+# Резервы заказов: по одной строке журнала на товар каждого заказа
+async def record_reservations(db: AsyncSession, order_ids: List[int], requested_per_order: List[dict]) -> None:
+    created_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    rows = [
+        {"product_id": product_id, "order_id": order_id, "quantity": -quantity,
+         "kind": "reserve", "created_at": created_at}
+        for order_id, requested in zip(order_ids, requested_per_order)
+        for product_id, quantity in requested.items()
+    ]
+    if rows:
+        await db.execute(insert(StockMovement), rows)
+
+
+# Текущий резерв заказов по журналу одним запросом:
+# id заказа -> {id товара: зарезервированное количество}
+async def order_reservations(db: AsyncSession, order_ids: List[int]) -> Dict[int, Dict[int, int]]:
+    result = await db.execute(
+        select(StockMovement.order_id, StockMovement.product_id, func.sum(StockMovement.quantity))
+        .where(StockMovement.order_id.in_(order_ids))
+        .group_by(StockMovement.order_id, StockMovement.product_id)
+    )
+    reserved: Dict[int, Dict[int, int]] = defaultdict(dict)
+    for order_id, product_id, net in result:
+        if net < 0:
+            reserved[order_id][product_id] = -net
+    return reserved
+
+
+# Отмена заказов: зарезервированный товар возвращается на склад. Шарды всех
+# товаров блокируются один раз, как при создании пачки заказов.
+# Возвращает id товаров, остаток которых изменился.
+async def release_order_stock(db: AsyncSession, order_ids: List[int]) -> List[int]:
+    reserved = await order_reservations(db, order_ids)
+    totals = await lock_stock(db, set().union(*reserved.values()))
+    released = {
+        order_id: {product_id: quantity for product_id, quantity in quantities.items() if product_id in totals}
+        for order_id, quantities in reserved.items()
+    }
+    returned: Dict[int, int] = defaultdict(int)
+    for quantities in released.values():
+        for product_id, quantity in quantities.items():
+            returned[product_id] += quantity
+    await write_stock(db, {product_id: totals[product_id] + quantity for product_id, quantity in returned.items()})
+    await record_movements(db, released, "release")
+    return sorted(returned)
+
+
+# Доставка заказов: резерв становится продажей, остаток не меняется
+async def confirm_order_stock(db: AsyncSession, order_ids: List[int]) -> None:
+    reserved = await order_reservations(db, order_ids)
+    await record_movements(db, {
+        order_id: {product_id: 0 for product_id in quantities} for order_id, quantities in reserved.items()
+    }, "confirm")
+
+
+# Уплотнение: снимок products.quantity догоняет сумму шардов, неравномерно
+# выбранные шарды делятся заново (иначе быстрый путь чаще уходит в медленный),
+# а движения давно закрытых заказов удаляются из журнала.
+# Доступный остаток при этом не меняется, поэтому кэш сбрасывать не нужно.
+# Товары для уплотнения отбираются без блокировок, а остаток пересчитывается и
+# записывается под блокировкой шардов (lock_stock), как при заказе: иначе сумма
+# шардов, прочитанная до сброса остатка (PUT, импорт), затёрла бы новый остаток.
+async def compact_stock(db: AsyncSession, retention_days: int = STOCK_LEDGER_RETENTION_DAYS) -> dict:
+    shard_totals = (
+        select(shards.c.product_id, func.sum(shards.c.quantity).label("total"))
+        .group_by(shards.c.product_id)
+        .subquery()
+    )
+    stale = set((await db.execute(
+        select(shard_totals.c.product_id)
+        .join(products, products.c.id == shard_totals.c.product_id)
+        .where(products.c.quantity != shard_totals.c.total)
+    )).scalars())
+    uneven = set((await db.execute(
+        select(shards.c.product_id)
+        .group_by(shards.c.product_id)
+        .having(func.max(shards.c.quantity) - func.min(shards.c.quantity) > 1)
+    )).scalars())
+    await db.commit()
+
+    compacted = sorted(stale | uneven)
+    for start in range(0, len(compacted), STOCK_COMPACTION_BATCH_SIZE):
+        # Пачками, чтобы не держать блокировки многих товаров
+        await write_stock(db, await lock_stock(db, compacted[start:start + STOCK_COMPACTION_BATCH_SIZE]))
+        await db.commit()
+
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=retention_days)
+    closed_orders = select(Order.id).where(Order.status.in_(CLOSED_ORDER_STATUSES), Order.created_at < cutoff)
+    pruned = (await db.execute(delete(StockMovement).where(StockMovement.order_id.in_(closed_orders)))).rowcount
+    await db.commit()
+
+    return {"refreshed": len(stale), "rebalanced": len(uneven), "pruned": pruned}
@@ -0,0 +1,51 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+
+from . import order_queue
+from .database import SessionLocal
+
+logger = logging.getLogger("warehouse.worker")
+
+
+# Цикл обработчика очереди заказов: пачки обрабатываются, пока очередь не опустеет,
+# затем очередь опрашивается раз в ORDER_QUEUE_POLL_INTERVAL секунд
+async def process_queue_forever():
+    while True:
+        try:
+            async with SessionLocal() as db:
+                processed = await order_queue.drain_order_queue(db)
+            if processed:
+                logger.info("Processed %d queued orders", processed)
+        except Exception:
+            logger.exception("Order queue processing failed")
+        await asyncio.sleep(order_queue.ORDER_QUEUE_POLL_INTERVAL)
+
+
+def run_worker():
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(process_queue_forever())
+
+
+# Запуск отдельных процессов-обработчиков очереди заказов:
+#   python -m src.worker --processes 4
+# Процессы забирают разные задания (SKIP LOCKED), поэтому их можно запускать
+# сколько угодно и на разных машинах.
+def main():
+    parser = argparse.ArgumentParser(description="Order queue worker")
+    parser.add_argument("--processes", type=int, default=1, help="number of worker processes")
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        run_worker()
+        return
+    workers = [multiprocessing.Process(target=run_worker) for _ in range(args.processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == "__main__":
+    main()